@@ -1,14 +1,17 @@
-from playwright.sync_api import sync_playwright
+from playwright.async_api import async_playwright
+import asyncio
 import time
+import hashlib
 import pyautogui
 import os
 import traceback
-import glob
 import io 
 from datetime import datetime, timedelta
 import pandas as pd
+import numpy as np
 import msal  # 🆕 Necessário (igual ao script Qive)
 import requests # 🆕 Necessário (igual ao script Qive)
+from PIL import Image
 
 # ================= CARREGAMENTO DE AMBIENTE =================
 from dotenv import load_dotenv
@@ -30,6 +33,7 @@ pyautogui.useImageNotFoundException(False)
 CAMINHO_DOWNLOADS = os.path.join(os.path.expanduser("~"), "Downloads")
 LARGURA_TELA, ALTURA_TELA = pyautogui.size()
 REGION_TOPO = (0, 0, LARGURA_TELA, 200)
+REGION_CENTRO = (LARGURA_TELA // 4, ALTURA_TELA // 4, LARGURA_TELA // 2, ALTURA_TELA // 2)
 
 # ========================================================
 # 🆕 FUNÇÕES DE UPLOAD (VINDAS DO SCRIPT QIVE)
@@ -89,7 +93,7 @@ def upload_via_graph_api(df_final):
 
         # 3. Preparar o Arquivo na Memória
         buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+        with pd.ExcelWriter(buffer, engine='xlsxwriter', datetime_format='YYYY-MM-DD') as writer:
             # Ajuste para garantir formatação de data no Excel se necessário, 
             # mas a conversão no dataframe já ajuda
             df_final.to_excel(writer, index=False)
@@ -116,7 +120,53 @@ def upload_via_graph_api(df_final):
 # ROBÔ PRINCIPAL (Bsoft)
 # ========================================================
 
-def acessar_bsoft():
+def carregar_templates(caminhos):
+    """Decodifica os PNGs de referência uma única vez (reutilizados em todas as buscas de tela)."""
+    templates = {}
+    for caminho in caminhos:
+        with Image.open(caminho) as img:
+            templates[caminho] = img.convert('RGB')
+    return templates
+
+def ler_primeira_tabela_html(caminho):
+    """Lê só a primeira <table> do HTML exportado, sem parsear as tabelas e scripts seguintes."""
+    # Import local: sem o lxml, a falha cai no tratamento de "Bibliotecas HTML ausentes" em vez de derrubar o script
+    from lxml import etree
+    primeira_tabela = None
+    for evento, elem in etree.iterparse(caminho, events=('start', 'end'), tag='table', html=True):
+        if evento == 'start' and primeira_tabela is None:
+            primeira_tabela = elem
+        elif evento == 'end' and elem is primeira_tabela:
+            html_tabela = etree.tostring(elem, encoding='unicode', method='html')
+            return pd.read_html(io.StringIO(html_tabela), decimal=',', thousands='.')[0]
+    return None
+
+def aguardar_tela_estavel(regiao, timeout, quadros_iguais=3, intervalo=0.1):
+    """
+    Espera a região da tela mudar e depois ficar estável por 'quadros_iguais' capturas seguidas.
+    Se nada acontecer, retorna após 'timeout' segundos (o mesmo tempo da antiga espera fixa).
+    """
+    limite = time.monotonic() + timeout
+    hash_inicial = hash_anterior = None
+    mudou, iguais = False, 0
+    while time.monotonic() < limite:
+        hash_atual = hashlib.blake2b(pyautogui.screenshot(region=regiao).tobytes(), digest_size=8).digest()
+        if hash_inicial is None:
+            hash_inicial = hash_atual
+        elif hash_atual != hash_inicial:
+            mudou = True
+        iguais = iguais + 1 if hash_atual == hash_anterior else 0
+        hash_anterior = hash_atual
+        if mudou and iguais >= quadros_iguais:
+            return True
+        time.sleep(intervalo)
+    return False
+
+async def localizar_na_tela(template, **kwargs):
+    """Executa o locateOnScreen (bloqueante) fora do event loop."""
+    return await asyncio.to_thread(pyautogui.locateOnScreen, template, **kwargs)
+
+async def acessar_bsoft():
     print("\n================ INÍCIO DO ROBÔ (VERSÃO GRAPH API) =================\n")
 
     diretorio_atual = os.path.dirname(os.path.abspath(__file__))
@@ -144,70 +194,75 @@ def acessar_bsoft():
             return
     print("✅ Imagens OK.\n")
 
-    with sync_playwright() as p:
+    async with async_playwright() as p:
         print("🚀 Iniciando Chrome...")
-        browser = p.chromium.launch(channel="chrome", headless=False, args=["--start-maximized"])
-        context = browser.new_context(accept_downloads=True, no_viewport=True)
-        page = context.new_page()
+        browser = await p.chromium.launch(channel="chrome", headless=False, args=["--start-maximized"])
+        context = await browser.new_context(accept_downloads=True, no_viewport=True)
+        page = await context.new_page()
 
         print(f"⚙️ Configurando Chrome para salvar em: {CAMINHO_DOWNLOADS}")
-        client = page.context.new_cdp_session(page)
-        client.send("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": CAMINHO_DOWNLOADS})
+        client = await page.context.new_cdp_session(page)
+        await client.send("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": CAMINHO_DOWNLOADS})
 
         try:
             # ================= FASE 1: Login Site =================
             print("🌐 [Fase 1] Acessando Bsoft...")
-            page.goto("https://sis.bsoft.com.br")
-            page.wait_for_selector('input', timeout=15000)
-            page.fill('input:visible', 'LLESS174')
-            page.keyboard.press('Enter'); time.sleep(2)
-            page.keyboard.type('bsoft2025')
-            page.keyboard.press('Enter'); time.sleep(3)
+            # Decodifica as imagens de referência enquanto a página carrega
+            _, templates = await asyncio.gather(
+                page.goto("https://sis.bsoft.com.br"),
+                asyncio.to_thread(carregar_templates, imagens)
+            )
+            await page.wait_for_selector('input', timeout=15000)
+            await page.fill('input:visible', 'LLESS174')
+            await page.keyboard.press('Enter'); await asyncio.sleep(2)
+            await page.keyboard.type('bsoft2025')
+            await page.keyboard.press('Enter'); await asyncio.sleep(3)
 
             # ================= FASE 2: Acesso Remoto =================
             print("\n🖥️ [Fase 2] Buscando acesso remoto...")
             imagem_encontrada = None
             for i in range(60):
                 # (Removido busca de seta aqui)
-                imagem_encontrada = pyautogui.locateOnScreen(img_login_remoto, confidence=0.8, grayscale=True)
+                imagem_encontrada = await localizar_na_tela(templates[img_login_remoto], confidence=0.8, grayscale=True)
                 if imagem_encontrada:
                     print(f"✅ Ícone encontrado ({i}s).")
                     break
-                time.sleep(1)
+                await asyncio.sleep(1)
 
             if not imagem_encontrada:
                 print("❌ ERRO: Ícone remoto não apareceu.")
                 return
 
             pyautogui.doubleClick(pyautogui.center(imagem_encontrada))
-            time.sleep(5)
+            # Não há template do diálogo de credenciais: mantém a espera fixa antiga antes de digitar
+            await asyncio.sleep(5)
             print("🔑 Credenciais remotas...")
             pyautogui.write('felipe.queiroz'); pyautogui.press('tab')
-            pyautogui.write('Felipe123!'); pyautogui.press('enter'); time.sleep(2)
-            pyautogui.press('enter'); print("✅ Conectado."); time.sleep(8)
+            pyautogui.write('Felipe123!'); pyautogui.press('enter'); await asyncio.sleep(2)
+            pyautogui.press('enter'); print("✅ Conectado."); await asyncio.to_thread(aguardar_tela_estavel, REGION_CENTRO, 8)
 
             # ================= FASE 3 a 7: Navegação =================
             print("📦 [Fase 3] Aguardando Sistema...")
             bsoft_carregado = False
             for i in range(120):
-                if pyautogui.locateOnScreen(img_bsoft_aberto, confidence=0.7, grayscale=True):
+                if await localizar_na_tela(templates[img_bsoft_aberto], confidence=0.7, grayscale=True):
                     bsoft_carregado = True; break
                 # (Removido busca de seta aqui também)
-                time.sleep(2)
+                await asyncio.sleep(2)
             
             if not bsoft_carregado:
                 print("❌ ERRO: Sistema não abriu."); return
             
             print("\n🧭 [Fase 4] Menu Alt+F...")
-            time.sleep(3); pyautogui.hotkey('alt', 'f'); time.sleep(3)
-            for _ in range(9): pyautogui.press('down'); time.sleep(1)
-            pyautogui.press('right'); time.sleep(0.5)
-            pyautogui.press('down'); time.sleep(0.5); pyautogui.press('down'); time.sleep(0.5); pyautogui.press('enter')
+            await asyncio.sleep(3); pyautogui.hotkey('alt', 'f'); await asyncio.sleep(3)
+            for _ in range(9): pyautogui.press('down'); await asyncio.sleep(1)
+            pyautogui.press('right'); await asyncio.sleep(0.5)
+            pyautogui.press('down'); await asyncio.sleep(0.5); pyautogui.press('down'); await asyncio.sleep(0.5); pyautogui.press('enter')
 
             print("⏳ Abrindo CTe...")
             for i in range(30):
-                if pyautogui.locateOnScreen(img_cte_aberto, confidence=0.8): break
-                time.sleep(1)
+                if await localizar_na_tela(templates[img_cte_aberto], confidence=0.8): break
+                await asyncio.sleep(1)
             else: return
 
 
@@ -228,52 +283,53 @@ def acessar_bsoft():
 
             # Digita a data calculada no sistema
             pyautogui.write(data_para_bsoft)
-            time.sleep(2)
+            await asyncio.sleep(2)
             
 
             print("\n📊 [Fase 6] Gerar Relatório...")
             pyautogui.hotkey('alt', 'f')
             for i in range(120):
-                if pyautogui.locateOnScreen(img_relatorio_ok, confidence=0.8): break
-                time.sleep(1)
+                if await localizar_na_tela(templates[img_relatorio_ok], confidence=0.8): break
+                await asyncio.sleep(1)
             else: return
 
             print("\n💾 [Fase 7] Menu Exportar...")
-            pyautogui.hotkey('alt', 'x'); time.sleep(1.5)
-            pyautogui.press('down'); time.sleep(0.5); pyautogui.press('down'); time.sleep(0.5); pyautogui.press('enter'); time.sleep(2.5)
-            for _ in range(5): pyautogui.press('tab'); time.sleep(0.5)
-            time.sleep(0.5); pyautogui.press('down'); time.sleep(1.5); pyautogui.press('enter')
-            for _ in range(4): pyautogui.press('tab'); time.sleep(0.5)
-            time.sleep(1.5); pyautogui.press('enter')
+            pyautogui.hotkey('alt', 'x'); await asyncio.sleep(1.5)
+            pyautogui.press('down'); await asyncio.sleep(0.5); pyautogui.press('down'); await asyncio.sleep(0.5); pyautogui.press('enter'); await asyncio.sleep(2.5)
+            for _ in range(5): pyautogui.press('tab'); await asyncio.sleep(0.5)
+            await asyncio.sleep(0.5); pyautogui.press('down'); await asyncio.sleep(1.5); pyautogui.press('enter')
+            for _ in range(4): pyautogui.press('tab'); await asyncio.sleep(0.5)
+            await asyncio.sleep(1.5); pyautogui.press('enter')
 
            # ================= FASE 8: BAIXAR =================
             print("\n👆 [Fase 8] Clicar em Abrir/Download...")
             print(f"🎯 Usando posição FIXA da seta: {memoria_posicao_seta}")
 
             # 1. Clica na posição fixa da seta
-            pyautogui.click(memoria_posicao_seta); time.sleep(1.5)
+            pyautogui.click(memoria_posicao_seta); await asyncio.sleep(1.5)
             
             # 2. Calcula o botão de download relativo à posição fixa
             novo_x = memoria_posicao_seta[0] + 35
             novo_y = memoria_posicao_seta[1] + 11
             
             print(f"🔽 Clicando no download em: {novo_x}, {novo_y}")
-            pyautogui.click(x=novo_x, y=novo_y, duration=0.5); time.sleep(5) 
+            pyautogui.click(x=novo_x, y=novo_y, duration=0.5); await asyncio.sleep(5) 
 
-            print("⌨️ Comandos Finais..."); pyautogui.write('exp'); time.sleep(0.8)
-            pyautogui.press('down'); time.sleep(0.5); pyautogui.press('enter'); time.sleep(0.5); pyautogui.press('enter')
+            print("⌨️ Comandos Finais..."); pyautogui.write('exp'); await asyncio.sleep(0.8)
+            pyautogui.press('down'); await asyncio.sleep(0.5); pyautogui.press('enter'); await asyncio.sleep(0.5); pyautogui.press('enter')
             
             # ================= FASE 9: AGUARDAR ARQUIVO =================
             print("\n⏳ [Fase 9] Esperando 20s...")
-            time.sleep(10) 
+            await asyncio.sleep(10) 
             print(f"🔎 Procurando em: {CAMINHO_DOWNLOADS}")
-            lista_arquivos = glob.glob(os.path.join(CAMINHO_DOWNLOADS, '*')) 
-            lista_arquivos = [f for f in lista_arquivos if os.path.isfile(f)]
+            # scandir: uma leitura do diretório e stat em cache por arquivo
+            with os.scandir(CAMINHO_DOWNLOADS) as entradas:
+                lista_arquivos = [e for e in entradas if e.is_file()]
             
             if not lista_arquivos:
                 print("❌ ERRO: Downloads vazia."); return
 
-            arquivo_recente = max(lista_arquivos, key=os.path.getmtime)
+            arquivo_recente = max(lista_arquivos, key=lambda e: e.stat().st_mtime).path
             print(f"✅ Arquivo encontrado: {os.path.basename(arquivo_recente)}")
 
             # ================= FASE 10: PROCESSAMENTO E UPLOAD =================
@@ -283,8 +339,7 @@ def acessar_bsoft():
                 df = None
                 if arquivo_recente.lower().endswith(('.htm', '.html')):
                     try:
-                        tabelas = pd.read_html(arquivo_recente, decimal=',', thousands='.')
-                        if tabelas: df = tabelas[0]
+                        df = ler_primeira_tabela_html(arquivo_recente)
                     except: print("❌ ERRO: Bibliotecas HTML ausentes."); return
                 else:
                     df = pd.read_excel(arquivo_recente)
@@ -325,19 +380,19 @@ def acessar_bsoft():
                     # 🛠️ AJUSTE SOLICITADO 2: DATA EMISSÃO (Remover Hora)
                     # ==========================================================
                     if 'Data Emissão' in df_final.columns:
-                        # Converte para datetime (dayfirst=True garante DD/MM/AAAA)
-                        # .dt.date extrai apenas a parte da data
-                        df_final['Data Emissão'] = pd.to_datetime(df_final['Data Emissão'], dayfirst=True, errors='coerce').dt.date
+                        # Formato fixo DD/MM/AAAA usa o parser em C do pandas (exact=False aceita a hora depois da data)
+                        # e o corte em datetime64[D] remove a hora sem criar objetos date do Python
+                        datas = pd.to_datetime(df_final['Data Emissão'], format='%d/%m/%Y', exact=False, errors='coerce')
+                        df_final['Data Emissão'] = datas.to_numpy().astype('datetime64[D]')
 
                     # ==========================================================
                     # 🛠️ AJUSTE: HORÁRIO DE CARREGAMENTO (somente HH:MM)
                     # ==========================================================
                     if 'horario de carregamento' in df_final.columns:
-                        df_final['horario de carregamento'] = (
-                            df_final['horario de carregamento']
-                            .astype(str)
-                            .str.strip()
-                            .str[:5]
+                        # Uma única passada (str + strip + corte) em vez de três Series intermediárias
+                        horarios = df_final['horario de carregamento'].to_numpy(dtype=object)
+                        df_final['horario de carregamento'] = np.array(
+                            ['' if pd.isna(h) else str(h).strip()[:5] for h in horarios], dtype=object
                         )
 
                     if "Local de entrega" in df_final.columns:
@@ -356,15 +411,18 @@ def acessar_bsoft():
 
                     coluna_alvo_prod = '[Item] Descrição'
                     if coluna_alvo_prod in df_final.columns:
-                        df_final[coluna_alvo_prod] = df_final[coluna_alvo_prod].astype(str).str.strip()
+                        produtos = df_final[coluna_alvo_prod].astype(str).str.strip().to_numpy(dtype=str)
                         regras = [
                             ('Gasolina C', 'Gasolina C'), ('Gasolina A', 'Gasolina A'), ('Anidro', 'Anidro'), 
                             ('Hidrat', 'Hidratado'), ('Biodiesel', 'Biodiesel'), ('A S10', 'Diesel A S10'),
                             ('A S500', 'Diesel A S500'), ('B S10', 'Diesel B S10'), ('B S500', 'Diesel B S500')
                         ]
-                        for termo, valor_final in regras:
-                            mask = df_final[coluna_alvo_prod].str.contains(termo, case=False, na=False)
-                            df_final.loc[mask, coluna_alvo_prod] = valor_final
+                        # np.select aplica a primeira regra que casar (mesmo resultado do loop sequencial,
+                        # já que nenhum valor final contém o termo de uma regra posterior)
+                        produtos_lower = np.char.lower(produtos)
+                        condicoes = [np.char.find(produtos_lower, termo.lower()) >= 0 for termo, _ in regras]
+                        escolhas = [valor_final for _, valor_final in regras]
+                        df_final[coluna_alvo_prod] = np.select(condicoes, escolhas, default=produtos).astype(object)
                         
                     # ================= 🆕 UPLOAD SHAREPOINT (NOVO MÉTODO) =================
                     upload_via_graph_api(df_final)
@@ -385,8 +443,8 @@ def acessar_bsoft():
             print("\n🔥 ERRO CRÍTICO GERAL 🔥")
             print(traceback.format_exc())
         finally:
-            time.sleep(5)
-            browser.close()
+            await asyncio.sleep(5)
+            await browser.close()
 
 if __name__ == "__main__":
-    acessar_bsoft()
\ No newline at end of file
+    asyncio.run(acessar_bsoft())
\ No newline at end of file
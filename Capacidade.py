@@ -3,18 +3,21 @@
 import io
 import os
 import logging
+import threading
 import pandas as pd
 import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 import openpyxl
 
 # --- BIBLIOTECAS PARA O GOOGLE SHEETS ---
 import gspread
-from gspread_dataframe import set_with_dataframe, get_as_dataframe
+from gspread_dataframe import get_as_dataframe
 from google.oauth2.service_account import Credentials
 
 # ==============================================================================
@@ -54,6 +57,8 @@ class Config:
     DRIVE_NAME: str = "Documentos"
     FOLDER_PATH: str = "Bases"
     
+    MAX_WORKERS: int = 8 # Downloads simultâneos do SharePoint
+    
     KEYWORDS_TO_EXCLUDE: List[str] = ["backup", "modelo", "corrompida", "corrompido", "dinamica"]
 
     FILENAME_MAP: Dict[str, str] = {
@@ -65,6 +70,8 @@ class Config:
         "STOCKMAT": "Stockmat", "TIF": "TIF", "TLIQ": "Tliq", "TRANSO": "Transo",
         "TRR_AB": "Americo", "TRR_CATANDUVA": "Catanduva", "VAISHIA": "Vaishia"
     }
+    # Chaves já em minúsculas, calculadas uma vez na carga da classe
+    FILENAME_MAP_LOWER: List[Tuple[str, str]] = [(key.lower(), value) for key, value in FILENAME_MAP.items()]
 
     @staticmethod
     def validate():
@@ -76,13 +83,17 @@ class SharePointClient:
     """Classe para interagir com a API do Microsoft Graph para o SharePoint."""
     def __init__(self, config: Config):
         self.config = config
+        # Sessão única com pool de conexões: reaproveita TCP/TLS entre chamadas e threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self.session.mount('https://', adapter)
         self.access_token = self._get_access_token()
         self.site_id = self._get_site_id()
         self.drive_id = self._get_drive_id()
 
     def _api_request(self, method: str, url: str, **kwargs) -> Dict[str, Any]:
         headers = {"Authorization": f"Bearer {self.access_token}"}
-        response = requests.request(method, url, headers=headers, **kwargs)
+        response = self.session.request(method, url, headers=headers, **kwargs)
         response.raise_for_status()
         if response.content and 'application/json' in response.headers.get('Content-Type', ''):
             return response.json()
@@ -94,7 +105,7 @@ class SharePointClient:
             "client_id": self.config.CLIENT_ID, "scope": "https://graph.microsoft.com/.default",
             "client_secret": self.config.CLIENT_SECRET, "grant_type": "client_credentials"
         }
-        response = requests.post(url, data=data)
+        response = self.session.post(url, data=data)
         response.raise_for_status()
         return response.json()["access_token"]
 
@@ -121,36 +132,37 @@ class SharePointClient:
             download_url = self._api_request('get', url_item).get('@microsoft.graph.downloadUrl')
             if not download_url: return None
             
-            response_content = requests.get(download_url, timeout=60)
+            response_content = self.session.get(download_url, timeout=60)
             response_content.raise_for_status()
             
-            xls = pd.ExcelFile(io.BytesIO(response_content.content))
-            actual_sheet_name = next((s for s in xls.sheet_names if s.lower() == nome_aba_fonte.lower()), None)
-            
-            if not actual_sheet_name:
-                logging.info(f"Aba '{nome_aba_fonte}' não encontrada no arquivo '{file_name}'. Pulando.")
-                return None
-
-            df_full = pd.read_excel(xls, sheet_name=actual_sheet_name, header=None)
+            # Leitura em streaming (read_only): localiza o bloco sem carregar a aba inteira no pandas
+            wb = openpyxl.load_workbook(io.BytesIO(response_content.content), read_only=True, data_only=True)
+            try:
+                actual_sheet_name = next((s for s in wb.sheetnames if s.lower() == nome_aba_fonte.lower()), None)
+                
+                if not actual_sheet_name:
+                    logging.info(f"Aba '{nome_aba_fonte}' não encontrada no arquivo '{file_name}'. Pulando.")
+                    return None
+                
+                linhas_bloco = []
+                for row in wb[actual_sheet_name].iter_rows(values_only=True):
+                    if not linhas_bloco:
+                        if any(texto_inicial in str(cell).lower() for cell in row if cell is not None):
+                            linhas_bloco.append(row)
+                    elif all(cell is None or cell == '' for cell in row):
+                        break
+                    else:
+                        linhas_bloco.append(row)
+            finally:
+                wb.close()
             
-            start_row_index = -1
-            for index, row in df_full.iterrows():
-                if any(texto_inicial in str(cell).lower() for cell in row if pd.notna(cell)):
-                    start_row_index = index
-                    break
-            
-            if start_row_index == -1: return None
-
-            df_data = df_full.iloc[start_row_index:].copy().reset_index(drop=True)
-            stop_row_index = next((index for index, row in df_data.iterrows() if row.isnull().all()), -1)
-            df_block = df_data.iloc[:stop_row_index] if stop_row_index != -1 else df_data
+            if not linhas_bloco: return None
             
-            if df_block.empty: return None
+            # Linhas em modo read_only podem ter larguras diferentes: completa com None
+            num_cols = max(len(row) for row in linhas_bloco)
+            linhas_bloco = [list(row) + [None] * (num_cols - len(row)) for row in linhas_bloco]
             
-            new_header = df_block.iloc[0]
-            df_final = df_block[1:].copy()
-            df_final.columns = new_header
-            df_final.reset_index(drop=True, inplace=True)
+            df_final = pd.DataFrame(linhas_bloco[1:], columns=linhas_bloco[0])
             df_final.dropna(axis=1, how='all', inplace=True)
 
             return df_final
@@ -166,12 +178,19 @@ class SharePointClient:
 def coletar_dados(sp_client: SharePointClient, files_to_process: list, config: Config, nome_aba_fonte: str, texto_inicial: str) -> pd.DataFrame:
     list_of_dataframes, success_count = [], 0
     
-    for item in files_to_process:
+    # Download + leitura de cada arquivo é limitado por rede: processa em paralelo.
+    # O executor.map preserva a ordem de 'files_to_process' nos resultados.
+    with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
+        resultados = list(executor.map(
+            lambda item: sp_client.extrair_bloco_de_dados(item['id'], item['name'], nome_aba_fonte, texto_inicial),
+            files_to_process
+        ))
+    
+    for item, df in zip(files_to_process, resultados):
         file_name = item['name']
-        df = sp_client.extrair_bloco_de_dados(item['id'], file_name, nome_aba_fonte, texto_inicial)
-        
         if df is not None and not df.empty:
-            mapped_name = next((value for key, value in config.FILENAME_MAP.items() if key.lower() in file_name.lower()), file_name)
+            file_name_lower = file_name.lower()
+            mapped_name = next((value for key, value in config.FILENAME_MAP_LOWER if key in file_name_lower), file_name)
             df['Origem'] = mapped_name
             list_of_dataframes.append(df)
             success_count += 1
@@ -180,8 +199,25 @@ def coletar_dados(sp_client: SharePointClient, files_to_process: list, config: C
             
     if not list_of_dataframes:
         return pd.DataFrame()
+    
+    # Mesmas colunas em ordem diferente: alinha antes para o concat não cair no caminho de união/alinhamento
+    colunas = list_of_dataframes[0].columns
+    if colunas.is_unique and all(set(df.columns) == set(colunas) for df in list_of_dataframes):
+        list_of_dataframes = [df if df.columns.equals(colunas) else df[colunas] for df in list_of_dataframes]
         
-    return pd.concat(list_of_dataframes, ignore_index=True)
+    return pd.concat(list_of_dataframes, ignore_index=True, copy=False, sort=False)
+
+def _dataframe_para_valores(df: pd.DataFrame) -> List[List[Any]]:
+    """Monta a matriz (cabeçalho + linhas) enviada ao Sheets: nulos viram '', colunas não numéricas viram texto."""
+    colunas = []
+    for i in range(df.shape[1]):
+        serie = df.iloc[:, i]
+        mascara_valida = serie.notna()
+        valores = serie.astype(object) if pd.api.types.is_numeric_dtype(serie) else serie.astype(str)
+        colunas.append(valores.where(mascara_valida, '').tolist())
+    
+    header = ['' if pd.isna(col) else str(col) for col in df.columns]
+    return [header] + [list(linha) for linha in zip(*colunas)]
 
 def salvar_no_sheets(client, df, url_planilha, nome_aba):
     try:
@@ -189,8 +225,11 @@ def salvar_no_sheets(client, df, url_planilha, nome_aba):
         spreadsheet = client.open_by_url(url_planilha)
         worksheet = spreadsheet.worksheet(nome_aba)
         worksheet.clear()
-        df_str = df.astype(str).replace('nan', '')
-        set_with_dataframe(worksheet, df_str, include_index=False, include_column_header=True, resize=True)
+        # Um único resize + um único update com a matriz pronta (sem a inferência célula a célula do gspread_dataframe).
+        # USER_ENTERED mantém a interpretação de datas/números pelo Sheets, como era feito antes.
+        valores = _dataframe_para_valores(df)
+        worksheet.resize(rows=len(valores), cols=max(len(valores[0]), 1))
+        worksheet.update(range_name='A1', values=valores, value_input_option='USER_ENTERED')
         logging.info(f"✅ {len(df)} linhas salvas com sucesso na aba '{nome_aba}'.")
     except gspread.exceptions.WorksheetNotFound:
         logging.error(f"❌ ERRO: A aba '{nome_aba}' não foi encontrada na planilha. Crie-a manualmente.")
@@ -259,6 +298,19 @@ def executar_processo(google_client, sp_client, files_to_process, config, url_sh
         
     salvar_no_sheets(google_client, df_final, url_sheets, nome_aba_destino)
 
+_thread_local = threading.local()
+
+def _google_client_da_thread():
+    """Cada thread autentica o seu próprio cliente gspread, que não é compartilhado entre threads."""
+    if getattr(_thread_local, 'google_client', None) is None:
+        _thread_local.google_client = autenticar_google_sheets()
+        if not _thread_local.google_client:
+            raise ConnectionError("Falha na autenticação com Google. O processo será interrompido.")
+    return _thread_local.google_client
+
+def _executar_processo_em_thread(**kwargs):
+    executar_processo(google_client=_google_client_da_thread(), **kwargs)
+
 # ==============================================================================
 # 5. EXECUÇÃO PRINCIPAL
 # ==============================================================================
@@ -269,10 +321,6 @@ def main():
         config = Config()
         config.validate()
         
-        google_client = autenticar_google_sheets()
-        if not google_client:
-            raise ConnectionError("Falha na autenticação com Google. O processo será interrompido.")
-            
         sp_client = SharePointClient(config)
         
         logging.info("Buscando lista de arquivos no SharePoint...")
@@ -282,28 +330,35 @@ def main():
         
         url_sheets = "https://docs.google.com/spreadsheets/d/19mc4J3oIm5oO_6oz5fjyNjgKE3lqgiw1H3rwyt8FuPE/edit?usp=sharing"
 
-        # --- PROCESSO 1: CAPACIDADE ---
-        # (Mantém o histórico, como antes)
-        executar_processo(
-            google_client=google_client, sp_client=sp_client, files_to_process=files_to_process, config=config,
-            url_sheets=url_sheets,
-            nome_aba_fonte="PAINEL DE TANQUES",
-            texto_inicial="lastro",
-            nome_aba_destino="Capacidade",
-            manter_historico=True
-        )
-        
-        # --- PROCESSO 2: TRANSFERÊNCIAS ---
-        # <<< PARÂMETRO 'manter_historico=False' ADICIONADO E NOME DA ABA CORRIGIDO >>>
-        executar_processo(
-            google_client=google_client, sp_client=sp_client, files_to_process=files_to_process, config=config,
-            url_sheets=url_sheets,
-            nome_aba_fonte="MOV. TQ",
-            texto_inicial="produto",
-            nome_aba_destino="Transf", # Corrigido para "Transf" como no seu log
-            aplicar_filtro_data=True,
-            manter_historico=False # Não mantém histórico, apenas substitui
-        )
+        # Os dois processos escrevem em abas diferentes e passam a maior parte do tempo esperando rede: rodam em paralelo
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futuros = [
+                # --- PROCESSO 1: CAPACIDADE ---
+                # (Mantém o histórico, como antes)
+                executor.submit(
+                    _executar_processo_em_thread,
+                    sp_client=sp_client, files_to_process=files_to_process, config=config,
+                    url_sheets=url_sheets,
+                    nome_aba_fonte="PAINEL DE TANQUES",
+                    texto_inicial="lastro",
+                    nome_aba_destino="Capacidade",
+                    manter_historico=True
+                ),
+                # --- PROCESSO 2: TRANSFERÊNCIAS ---
+                # <<< PARÂMETRO 'manter_historico=False' ADICIONADO E NOME DA ABA CORRIGIDO >>>
+                executor.submit(
+                    _executar_processo_em_thread,
+                    sp_client=sp_client, files_to_process=files_to_process, config=config,
+                    url_sheets=url_sheets,
+                    nome_aba_fonte="MOV. TQ",
+                    texto_inicial="produto",
+                    nome_aba_destino="Transf", # Corrigido para "Transf" como no seu log
+                    aplicar_filtro_data=True,
+                    manter_historico=False # Não mantém histórico, apenas substitui
+                ),
+            ]
+            for futuro in futuros:
+                futuro.result()
 
         logging.info("====== EXECUÇÃO COMPLETA DO SCRIPT FINALIZADA ======")
 
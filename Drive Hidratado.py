@@ -13,10 +13,14 @@ import sys
 import time
 import logging
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Tuple, Set
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 
 # ==============================================================================
@@ -27,6 +31,15 @@ warnings.filterwarnings('ignore', category=UserWarning, module='openpyxl')
 # Correção para compatibilidade futura do Pandas
 pd.set_option('future.no_silent_downcasting', True)
 
+# Strings Arrow quando o pyarrow estiver disponível (kernels vetorizados em C); senão, o dtype 'string' nativo
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    STRING_DTYPE = 'string'
+
+_KEY_RE = re.compile('[^a-z0-9]')
+
 load_dotenv()
 
 class Config:
@@ -35,6 +48,7 @@ class Config:
     DESCARGAS_CONFIG: Dict[str, Any] = {
         "name": "Descargas DataLake", "site_path": "/sites/DataLake", "drive_name": "Documentos", "folder_path": "Bases", "sheet_name": "Descarga",
         "header": ['faturista', 'produto', 'origem', 'empresa', 'data', 'hora', 'placa', 'motorista', 'nota', 'quantidade_nf', 'op_tanque', 'aditivar', 'aditivo', 'dias_em_espera', 'status', 'data_de_descarga', 'hr_entrada'],
+        "colunas_texto": ['nota', 'placa', 'produto', 'status'],
         "products_to_include": ['anidro', 'hidratado', 'biodiesel', 'gasolina a', 'gasolina c', 'diesel a s10', 'diesel b s10', 'diesel a s500', 'diesel b s500', 'mgo']
     }
     
@@ -43,6 +57,7 @@ class Config:
         "folder_path": "",
         "sheet_name": "Base",
         "header": ["sm", "data_prev_carregamento", "expedidor", "cidade_origem", "ufo", "destinatario_venda", "destinatario", "recebedor", "cidade_destino", "ufd", "produto", "motorista", "cavalo", "carreta1", "carreta2", "transportadora", "nfe", "volume_l", "data_de_carregamento", "horario_de_carregamento", "data_chegada", "data_descarga", "status"],
+        "colunas_texto": ['nfe', 'recebedor', 'produto', 'cavalo'],
         "status_para_incluir": ["Em Trânsito", "Aguardando Descarga", "Em Trânsito By Pass", "Aguardando By Pass"],
         "arquivos_para_ler": [
             "FORM-PPL-000 - Fitplan Hidratado - RJ.xlsx",
@@ -57,6 +72,7 @@ class Config:
         "file_name": "Relatório de divergência Hidratado.xlsx"
     }
     
+    MAX_WORKERS: int = 8 # Downloads simultâneos do SharePoint
     KEYWORDS_TO_EXCLUDE: List[str] = ["backup", "modelo", "corrompida", "corrompido", "dinamica"]
     FILENAME_MAP: Dict[str, str] = {
         "ARUJA": "Aruja", "BARRA_MANSA": "Barra Mansa", "BCAG": "BCAG",
@@ -73,20 +89,51 @@ class Config:
         if not all([Config.TENANT_ID, Config.CLIENT_ID, Config.CLIENT_SECRET]):
             raise ValueError("❌ Faltam credenciais no arquivo .env."); logging.info("Configurações de ambiente carregadas.")
 
+# Máximo de sub-requisições aceitas pelo endpoint $batch do Graph
+GRAPH_BATCH_LIMIT = 20
+GRAPH_MAX_TENTATIVAS = 5 # Tentativas por requisição quando o Graph responde 429
+# Status de sub-requisição do $batch que valem nova tentativa (limitação / serviço indisponível)
+GRAPH_STATUS_REENVIO = {429, 503}
+
+# Letras das colunas A..ZZ (índices 0..701), pré-calculadas para os endereços de range
+_EXCEL_COLS: List[str] = [chr(65 + i) for i in range(26)] + [chr(65 + i) + chr(65 + j) for i in range(26) for j in range(26)]
+
+# Caches compartilhados entre instâncias do SharePointClient (mesmo tenant/site ao longo da execução)
+_TOKEN_CACHE: Dict[Tuple[str, str], Tuple[str, float]] = {}
+_SITE_CACHE: Dict[Tuple[str, str], str] = {}
+_DRIVE_CACHE: Dict[Tuple[str, str], str] = {}
+
 class SharePointClient:
     def __init__(self, site_config: Dict[str, Any], config: Config):
         self.site_config = site_config
         self.config = config
+        # Sessão com keep-alive: um handshake TLS por host em vez de um por requisição
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+        self.session.mount('https://', adapter)
         self.access_token = self._get_access_token()
         self.site_id = self._get_site_id()
         self.drive_id = self._get_drive_id()
+        # Prefixos de URL montados uma única vez (quote é Python puro e era refeito a cada chamada)
+        self._drive_root = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}"
+        self._encoded_folder = requests.utils.quote(self.site_config.get('folder_path', ''))
+        self._file_id_cache: Dict[str, str] = {}
 
-    def _api_request(self, method: str, url: str, json: Dict = None, data=None) -> Dict[str, Any]:
+    def _api_request(self, method: str, url: str, json: Dict = None, data=None, extra_headers: Dict[str, str] = None) -> Dict[str, Any]:
         headers = {"Authorization": f"Bearer {self.access_token}"}
         if data:
             headers['Content-Type'] = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        if extra_headers:
+            headers.update(extra_headers)
         
-        response = requests.request(method, url, headers=headers, json=json, data=data)
+        # Em vez de pausas fixas entre chamadas, respeita o Retry-After quando o Graph limita (HTTP 429)
+        for tentativa in range(GRAPH_MAX_TENTATIVAS):
+            response = self.session.request(method, url, headers=headers, json=json, data=data)
+            if response.status_code != 429 or tentativa == GRAPH_MAX_TENTATIVAS - 1:
+                break
+            espera = float(response.headers.get('Retry-After', 2 ** tentativa))
+            logging.warning(f"Graph limitou as requisições (HTTP 429). Nova tentativa em {espera:.0f}s...")
+            time.sleep(espera)
         response.raise_for_status()
         
         is_json_response = 'application/json' in response.headers.get('Content-Type', '')
@@ -95,101 +142,235 @@ class SharePointClient:
         return None
 
     def _get_access_token(self) -> str:
+        cache_key = (self.config.TENANT_ID, self.config.CLIENT_ID)
+        token_em_cache = _TOKEN_CACHE.get(cache_key)
+        if token_em_cache and token_em_cache[1] > time.time():
+            return token_em_cache[0]
+        
         url = f"https://login.microsoftonline.com/{self.config.TENANT_ID}/oauth2/v2.0/token"
         data = {"client_id": self.config.CLIENT_ID, "scope": "https://graph.microsoft.com/.default", "client_secret": self.config.CLIENT_SECRET, "grant_type": "client_credentials"}
-        response = requests.post(url, data=data)
+        response = self.session.post(url, data=data)
         response.raise_for_status()
-        return response.json()["access_token"]
+        token_json = response.json()
+        # Margem de 60s antes da expiração real
+        _TOKEN_CACHE[cache_key] = (token_json["access_token"], time.time() + int(token_json.get("expires_in", 3600)) - 60)
+        return token_json["access_token"]
 
     def _get_site_id(self) -> str:
-        url = f"https://graph.microsoft.com/v1.0/sites/{self.config.HOSTNAME}:{self.site_config['site_path']}"
-        return self._api_request('get', url)["id"]
+        cache_key = (self.config.HOSTNAME, self.site_config['site_path'])
+        if cache_key not in _SITE_CACHE:
+            url = f"https://graph.microsoft.com/v1.0/sites/{self.config.HOSTNAME}:{self.site_config['site_path']}"
+            _SITE_CACHE[cache_key] = self._api_request('get', url)["id"]
+        return _SITE_CACHE[cache_key]
 
     def _get_drive_id(self) -> str:
+        cache_key = (self.site_id, self.site_config['drive_name'].lower())
+        if cache_key in _DRIVE_CACHE:
+            return _DRIVE_CACHE[cache_key]
+        
         url = f"https://graph.microsoft.com/v1.0/sites/{self.site_id}/drives"
         drives = self._api_request('get', url).get("value", [])
         drive_name_lower = self.site_config['drive_name'].lower()
         for drive in drives:
-            if drive['name'].lower() == drive_name_lower: return drive['id']
+            if drive['name'].lower() == drive_name_lower:
+                _DRIVE_CACHE[cache_key] = drive['id']
+                return drive['id']
         raise FileNotFoundError(f"Biblioteca '{self.site_config['drive_name']}' não encontrada.")
 
     def get_files_in_folder(self) -> List[Dict[str, Any]]:
-        path_segment = f"/root:/{requests.utils.quote(self.site_config['folder_path'])}:" if self.site_config['folder_path'] else "/root"
-        url = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}{path_segment}/children"
+        path_segment = f"/root:/{self._encoded_folder}:" if self._encoded_folder else "/root"
+        url = f"{self._drive_root}{path_segment}/children"
         return self._api_request('get', url).get("value", [])
 
     def read_excel_sheet(self, file_id: str, file_name: str) -> pd.DataFrame | None:
         try:
-            url_item = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}"
+            url_item = f"{self._drive_root}/items/{file_id}"
             download_url = self._api_request('get', url_item).get('@microsoft.graph.downloadUrl')
             if not download_url: return None
             
-            response_content = requests.get(download_url, timeout=60)
-            response_content.raise_for_status()
+            buffer = io.BytesIO()
+            with self.session.get(download_url, stream=True, timeout=60) as response_content:
+                response_content.raise_for_status()
+                for chunk in response_content.iter_content(chunk_size=1 << 20):
+                    buffer.write(chunk)
+            buffer.seek(0)
             
-            xls = pd.ExcelFile(io.BytesIO(response_content.content))
+            # Leitor em Rust (python-calamine): bem mais rápido que o openpyxl para planilhas grandes
+            xls = pd.ExcelFile(buffer, engine='calamine')
             sheet_name_to_find = self.site_config['sheet_name'].lower()
             actual_sheet_name = next((s for s in xls.sheet_names if s.lower() == sheet_name_to_find), None)
             
             if actual_sheet_name:
-                df = pd.read_excel(xls, sheet_name=actual_sheet_name, header=None)
+                # Sonda só as 15 primeiras linhas atrás do cabeçalho; a leitura completa já começa nos dados.
+                # dtype=object mantém os valores das células como na leitura antiga (sem inferência por coluna)
+                probe = pd.read_excel(xls, sheet_name=actual_sheet_name, header=None, nrows=15, dtype=object)
                 
                 header_list = self.site_config['header']
                 header_keyword = 'sm' if self.site_config['name'] == 'Transportes' else 'produto'
 
-                for i, row in df.head(15).iterrows():
-                    if any(str(cell).strip().lower() == header_keyword for cell in row):
-                        df_data = df.iloc[i + 1:].copy()
-                        num_expected_cols = len(header_list)
-                        df_data = df_data.iloc[:, :num_expected_cols]
-                        df_data.columns = header_list
-                        
-                        df_final = df_data.reset_index(drop=True)
-                        df_final['__ms_file_id'] = file_id
-                        df_final['__ms_sheet_name'] = actual_sheet_name
-                        df_final['__ms_row_index'] = df_final.index + i + 2
-                        
-                        return df_final
+                # Comparação única na matriz da sonda: primeira linha com alguma célula igual à palavra-chave
+                celulas = np.char.lower(np.char.strip(probe.to_numpy(dtype=str)))
+                linhas_cabecalho = np.flatnonzero((celulas == header_keyword).any(axis=1))
+                
+                if linhas_cabecalho.size:
+                    i = int(linhas_cabecalho[0])
+                    df_final = pd.read_excel(xls, sheet_name=actual_sheet_name, header=None, skiprows=i + 1,
+                                             usecols=range(len(header_list)), names=header_list, dtype=object)
+                    
+                    df_final['__ms_file_id'] = file_id
+                    df_final['__ms_sheet_name'] = actual_sheet_name
+                    df_final['__ms_row_index'] = df_final.index + i + 2
+                    
+                    # Colunas de texto já tipadas (Arrow): o concat e a montagem das chaves não copiam objetos Python
+                    colunas_texto = self.site_config.get('colunas_texto', [])
+                    df_final[colunas_texto] = df_final[colunas_texto].astype(STRING_DTYPE)
+                    
+                    return df_final
             return None
         except Exception as e:
             logging.error(f"Falha ao ler o arquivo {file_name} (ID: {file_id}). Erro: {e}")
             return None
 
-    def update_cell(self, file_id: str, sheet_name: str, row_index: int, col_name: str, value: Any):
+    def create_workbook_session(self, file_id: str) -> str | None:
+        """Abre uma sessão persistente no workbook para agrupar as escritas no servidor."""
         try:
-            col_list = Config.TRANSPORTES_CONFIG['header']
-            col_idx = col_list.index(col_name)
-            
-            api_row = row_index - 1
-            api_col = col_idx
-            
-            url = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets/{sheet_name}/cell(row={api_row},column={api_col})"
-            payload = {'values': [[value]]}
-            
-            self._api_request('patch', url, json=payload)
-        except ValueError:
-            logging.error(f"A coluna '{col_name}' não foi encontrada na lista de colunas de configuração.")
+            url = f"{self._drive_root}/items/{file_id}/workbook/createSession"
+            return self._api_request('post', url, json={'persistChanges': True})['id']
         except Exception as e:
-            logging.error(f"Erro ao atualizar a célula na Linha {row_index}, Coluna '{col_name}': {e}")
+            logging.warning(f"Não foi possível abrir sessão no workbook {file_id}, seguindo sem sessão: {e}")
+            return None
 
-    def _get_range_url(self, file_id: str, sheet_name: str, range_address: str) -> str:
-        return f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets/{sheet_name}/range(address='{range_address}')"
+    def close_workbook_session(self, file_id: str, session_id: str):
+        try:
+            url = f"{self._drive_root}/items/{file_id}/workbook/closeSession"
+            self._api_request('post', url, extra_headers={'workbook-session-id': session_id})
+        except Exception as e:
+            logging.warning(f"Não foi possível fechar a sessão do workbook {file_id}: {e}")
 
-    def format_range(self, file_id: str, sheet_name: str, range_address: str, format_payload: Dict[str, Any]):
+    def batch_update_rows(self, file_id: str, sheet_name: str, row_indices: List[int], values_2d: List[List[Any]],
+                          first_col_name: str, session_id: str = None):
+        """
+        Escreve linhas inteiras de uma vez: agrupa as linhas em blocos contíguos e envia um PATCH de range por bloco,
+        em lotes do $batch.
+        Valores None no array não alteram a célula correspondente.
+        """
         try:
-            url = f"{self._get_range_url(file_id, sheet_name, range_address)}/format/fill"
-            self._api_request('patch', url, json=format_payload)
-            logging.info(f"Cor de preenchimento aplicada ao range '{range_address}' no arquivo {file_id}.")
+            col_idx = Config.TRANSPORTES_CONFIG['header'].index(first_col_name)
+        except ValueError:
+            logging.error(f"A coluna '{first_col_name}' não foi encontrada na lista de colunas de configuração.")
+            return
+        if not values_2d: return
+
+        col_inicial = self._convert_to_excel_col(col_idx)
+        col_final = self._convert_to_excel_col(col_idx + len(values_2d[0]) - 1)
+        extra_headers = {'workbook-session-id': session_id} if session_id else None
+
+        # Quebra em blocos onde a diferença entre linhas vizinhas (ordenadas) não é 1
+        ordem = np.argsort(np.asarray(row_indices), kind='stable')
+        linhas_ordenadas = np.asarray(row_indices)[ordem]
+        cortes = np.flatnonzero(np.diff(linhas_ordenadas) != 1) + 1
+        blocos = [[(int(linhas_ordenadas[p]), values_2d[ordem[p]]) for p in posicoes]
+                  for posicoes in np.split(np.arange(len(ordem)), cortes)]
+
+        # Um PATCH por bloco, todos pelo $batch; dentro de cada lote os PATCHes são encadeados (dependsOn)
+        # para o Excel aplicá-los em sequência no mesmo workbook
+        sub_requests = []
+        for n, bloco in enumerate(blocos):
+            address = f"{col_inicial}{bloco[0][0]}:{col_final}{bloco[-1][0]}"
+            depends_on = str(n - 1) if n % GRAPH_BATCH_LIMIT else None
+            sub_requests.append(self._range_sub_request(str(n), file_id, sheet_name, address, {'values': [valores for _, valores in bloco]},
+                                                        depends_on=depends_on, extra_headers=extra_headers))
+        try:
+            self.batch_requests(sub_requests)
         except Exception as e:
-            logging.warning(f"Não foi possível aplicar cor ao range '{range_address}': {e}")
-            
-    def update_range_value(self, file_id: str, sheet_name: str, cell_address: str, value: Any):
+            # Propaga para o chamador: escrita parcial não pode terminar com a sinalização de sucesso
+            logging.error(f"Erro ao atualizar as linhas do arquivo {file_id}: {e}")
+            raise
+
+    def _get_range_url(self, file_id: str, sheet_name: str, range_address: str) -> str:
+        return f"{self._drive_root}/items/{file_id}/workbook/worksheets/{sheet_name}/range(address='{range_address}')"
+
+    def _enviar_lote(self, lote: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Envia um lote do $batch. Sub-requisições com 429/503 (e as que caíram em 424 por dependerem delas)
+        são reenviadas respeitando o Retry-After. Se ainda restar alguma falha, levanta RuntimeError.
+        """
+        respostas: Dict[str, Dict[str, Any]] = {}
+        pendentes = lote
+        for tentativa in range(GRAPH_MAX_TENTATIVAS):
+            resposta = self._api_request('post', "https://graph.microsoft.com/v1.0/$batch", json={'requests': pendentes})
+            respostas.update({sub_resposta['id']: sub_resposta for sub_resposta in resposta.get('responses', [])})
+
+            # Em ordem de envio: reenvia as limitadas e as que falharam só por dependerem de uma reenviada
+            reenviar = []
+            ids_reenviados = set()
+            for sub_request in pendentes:
+                status = respostas.get(sub_request['id'], {}).get('status', 500)
+                depende_de_reenviada = bool(ids_reenviados.intersection(sub_request.get('dependsOn', [])))
+                if status in GRAPH_STATUS_REENVIO or (status == 424 and depende_de_reenviada):
+                    ids_reenviados.add(sub_request['id'])
+                    reenviar.append(sub_request)
+            if not reenviar or tentativa == GRAPH_MAX_TENTATIVAS - 1:
+                break
+
+            # dependsOn só pode apontar para sub-requisições do mesmo lote: remove os que já foram concluídos
+            pendentes = []
+            for sub_request in reenviar:
+                sub_request = dict(sub_request)
+                depends_on = [id_dep for id_dep in sub_request.pop('dependsOn', []) if id_dep in ids_reenviados]
+                if depends_on:
+                    sub_request['dependsOn'] = depends_on
+                pendentes.append(sub_request)
+            espera = max(float(respostas[sub_request['id']].get('headers', {}).get('Retry-After', 2 ** tentativa)) for sub_request in pendentes)
+            logging.warning(f"Graph limitou {len(pendentes)} sub-requisição(ões) do lote. Nova tentativa em {espera:.0f}s...")
+            time.sleep(espera)
+
+        falhas = [sub_resposta for sub_resposta in respostas.values() if sub_resposta.get('status', 500) >= 400]
+        for sub_resposta in falhas:
+            erro = (sub_resposta.get('body') or {}).get('error', {}).get('message', '')
+            logging.error(f"Sub-requisição {sub_resposta.get('id')} do lote falhou (HTTP {sub_resposta.get('status')}): {erro}")
+        if falhas:
+            raise RuntimeError(f"{len(falhas)} de {len(lote)} sub-requisição(ões) do $batch falharam.")
+        return [respostas[sub_request['id']] for sub_request in lote if sub_request['id'] in respostas]
+
+    def batch_requests(self, sub_requests: List[Dict[str, Any]], max_workers: int = 1) -> List[Dict[str, Any]]:
+        """
+        Envia as sub-requisições pelo endpoint $batch do Graph, em lotes de até 20 (limite da API).
+        Sub-requisições ligadas por 'dependsOn' devem ficar no mesmo lote de 20. Com max_workers > 1 os lotes
+        são enviados em paralelo, então só use quando lotes diferentes não mexem no mesmo workbook.
+        """
+        lotes = [sub_requests[inicio:inicio + GRAPH_BATCH_LIMIT] for inicio in range(0, len(sub_requests), GRAPH_BATCH_LIMIT)]
+        if max_workers > 1 and len(lotes) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                respostas_por_lote = list(executor.map(self._enviar_lote, lotes))
+        else:
+            respostas_por_lote = [self._enviar_lote(lote) for lote in lotes]
+        return [sub_resposta for respostas in respostas_por_lote for sub_resposta in respostas]
+
+    def _range_sub_request(self, request_id: str, file_id: str, sheet_name: str, range_address: str, body: Dict[str, Any],
+                           sufixo: str = '', depends_on: str = None, extra_headers: Dict[str, str] = None) -> Dict[str, Any]:
+        # URLs do $batch são relativas à versão da API
+        url = self._get_range_url(file_id, sheet_name, range_address).replace("https://graph.microsoft.com/v1.0", "", 1) + sufixo
+        sub_request = {'id': request_id, 'method': 'PATCH', 'url': url, 'headers': {'Content-Type': 'application/json', **(extra_headers or {})}, 'body': body}
+        if depends_on:
+            sub_request['dependsOn'] = [depends_on]
+        return sub_request
+
+    def sinalizar_arquivos(self, file_ids: List[str], sheet_name: str, status_range: str, format_payload: Dict[str, Any], mensagem: str):
+        """
+        Pinta o range de status e escreve a mensagem em A1 de cada arquivo, tudo pelo $batch (cor e depois texto).
+        O par de cada arquivo fica no mesmo lote, então lotes diferentes podem ir em paralelo.
+        """
+        sub_requests = []
+        for n, file_id in enumerate(file_ids):
+            id_cor, id_mensagem = f"{n}-cor", f"{n}-msg"
+            sub_requests.append(self._range_sub_request(id_cor, file_id, sheet_name, status_range, format_payload, sufixo='/format/fill'))
+            sub_requests.append(self._range_sub_request(id_mensagem, file_id, sheet_name, 'A1', {'values': [[mensagem]]}, depends_on=id_cor))
         try:
-            url = self._get_range_url(file_id, sheet_name, cell_address)
-            payload = {'values': [[value]]}
-            self._api_request('patch', url, json=payload)
+            self.batch_requests(sub_requests, max_workers=self.config.MAX_WORKERS)
+            logging.info(f"Sinalização aplicada ao range '{status_range}' de {len(file_ids)} arquivo(s).")
         except Exception as e:
-            logging.error(f"Não foi possível atualizar valor da célula '{cell_address}': {e}")
+            logging.warning(f"Não foi possível sinalizar os arquivos: {e}")
 
     # ==============================================================================
     # NOVO MÉTODO DE OUTPUT DO RELATÓRIO (IGUAL AO SCRIPT PARALELO)
@@ -197,6 +378,8 @@ class SharePointClient:
 
     def _convert_to_excel_col(self, n: int) -> str:
         """Converte índice numérico (0, 1, 27) para letra (A, B, AB)."""
+        if n < len(_EXCEL_COLS):
+            return _EXCEL_COLS[n]
         string = ""
         while n >= 0:
             string = chr(n % 26 + 65) + string
@@ -205,18 +388,23 @@ class SharePointClient:
 
     def get_file_id_by_name(self, file_name: str) -> str:
         """Busca o ID de um arquivo específico na pasta configurada."""
+        if file_name in self._file_id_cache:
+            return self._file_id_cache[file_name]
         try:
-            folder_path = self.site_config.get('folder_path', '')
-            if folder_path:
+            if self._encoded_folder:
                 # Evita duplicação de /root/root se houver subpasta
-                encoded_path = f"{requests.utils.quote(folder_path)}/{requests.utils.quote(file_name)}"
+                encoded_path = f"{self._encoded_folder}/{requests.utils.quote(file_name)}"
             else:
                 encoded_path = requests.utils.quote(file_name)
 
-            url = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/root:/{encoded_path}"
+            url = f"{self._drive_root}/root:/{encoded_path}"
             
             response = self._api_request('get', url)
-            return response['id'] if response else None
+            if response:
+                # Só IDs encontrados vão para o cache: um arquivo ausente pode ser criado logo em seguida
+                self._file_id_cache[file_name] = response['id']
+                return response['id']
+            return None
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 404:
                 return None
@@ -238,7 +426,7 @@ class SharePointClient:
             file_name = config_relatorio['file_name']
             
             path_segment = f"/{requests.utils.quote(folder_path)}" if folder_path else ""
-            url = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/root:{path_segment}/{requests.utils.quote(file_name)}:/content"
+            url = f"{self._drive_root}/root:{path_segment}/{requests.utils.quote(file_name)}:/content"
             
             logging.info(f"Criando novo arquivo no SharePoint: '{file_name}'...")
             self._api_request('put', url, data=excel_data)
@@ -257,12 +445,13 @@ class SharePointClient:
         # 1. Preparar os dados
         df_clean = df_to_write.fillna('').astype(str)
         
-        # Limpar '.0' de strings numéricas
-        for col in df_clean.columns:
-            df_clean[col] = df_clean[col].str.replace(r'\.0$', '', regex=True)
+        # Limpar '.0' de strings numéricas: uma única varredura na matriz inteira, cortando só as células marcadas
+        valores = df_clean.to_numpy(dtype=object)
+        mascara_ponto_zero = np.char.endswith(valores.astype(str), '.0')
+        valores[mascara_ponto_zero] = [valor[:-2] for valor in valores[mascara_ponto_zero]]
 
         header = [str(col) for col in df_clean.columns]
-        dados_lista = [header] + df_clean.values.tolist()
+        dados_lista = [header] + valores.tolist()
         
         num_rows = len(dados_lista)
         num_cols = len(dados_lista[0]) if num_rows > 0 else 0
@@ -279,13 +468,13 @@ class SharePointClient:
             logging.info(f"Arquivo '{file_name}' encontrado. Atualizando aba '{sheet_name_target}'...")
 
             # 3. Verificar se a aba existe
-            url_worksheets = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets"
+            url_worksheets = f"{self._drive_root}/items/{file_id}/workbook/worksheets"
             response_sheets = self._api_request('get', url_worksheets)
             existing_sheets = [sheet['name'] for sheet in response_sheets.get('value', [])]
 
             if sheet_name_target in existing_sheets:
                 # Se existe, limpa o conteúdo (mantendo formatação, igual ao script paralelo)
-                url_clear = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets/{sheet_name_target}/range/clear"
+                url_clear = f"{self._drive_root}/items/{file_id}/workbook/worksheets/{sheet_name_target}/range/clear"
                 self._api_request('post', url_clear, json={'applyTo': 'contents'})
                 logging.debug(f"Conteúdo da aba '{sheet_name_target}' limpo.")
             else:
@@ -298,7 +487,7 @@ class SharePointClient:
                 col_letter = self._convert_to_excel_col(num_cols - 1)
                 address_range = f"A1:{col_letter}{num_rows}"
                 
-                url_write = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets/{sheet_name_target}/range(address='{address_range}')"
+                url_write = f"{self._drive_root}/items/{file_id}/workbook/worksheets/{sheet_name_target}/range(address='{address_range}')"
                 self._api_request('patch', url_write, json={'values': dados_lista})
             
             logging.info(f"Sucesso! {num_rows} linhas escritas na aba '{sheet_name_target}'.")
@@ -309,10 +498,36 @@ class SharePointClient:
 
 def _normalizar_texto_para_chave(series: Any) -> Any:
     if isinstance(series, pd.Series):
-        return series.astype(str).str.strip().str.lower().str.replace('[^a-z0-9]', '', regex=True)
+        # Uma única passada de regex sobre strings Arrow (o padrão já remove os espaços das pontas)
+        return series.astype(STRING_DTYPE).str.lower().str.replace(_KEY_RE.pattern, '', regex=True).fillna('')
     else:
         texto_str = str(series).strip().lower()
-        return re.sub('[^a-z0-9]', '', texto_str)
+        return _KEY_RE.sub('', texto_str)
+
+def _mascara_por_categoria(serie: pd.Series, predicado) -> pd.Series:
+    """
+    Avalia o predicado uma única vez por valor distinto (categorias da coluna) e expande o resultado
+    para as linhas pelos códigos inteiros. Valores nulos são avaliados como o texto 'nan'.
+    """
+    categorica = serie.astype('category')
+    resultado_categorias = np.asarray(predicado(categorica.cat.categories.astype(str).to_series()), dtype=bool)
+    resultado_nulo = bool(predicado(pd.Series(['nan'])).iloc[0])
+    # O código -1 (nulo) indexa o último elemento, que é o resultado para nulos
+    resultado = np.append(resultado_categorias, resultado_nulo)
+    return pd.Series(resultado[categorica.cat.codes.to_numpy()], index=serie.index)
+
+def _padronizar_fonte(fontes: pd.Series, filename_map: Dict[str, str]) -> pd.Series:
+    """
+    De-para do nome do arquivo para a fonte padronizada, avaliado uma única vez por nome distinto.
+    Entre as chaves contidas no nome vence a que vem por último no FILENAME_MAP, em qualquer posição
+    do nome (mesmo resultado do laço de substituições sucessivas). Sem chave, mantém o nome original.
+    """
+    chaves = [(chave.lower(), valor) for chave, valor in reversed(filename_map.items())]
+    codigos, nomes = pd.factorize(fontes)
+    padronizados = [next((valor for chave, valor in chaves if chave in str(nome).lower()), nome) for nome in nomes]
+    # O código -1 (nulo) indexa o último elemento, que mantém o nulo
+    padronizados = np.array(padronizados + [np.nan], dtype=object)
+    return pd.Series(padronizados[codigos], index=fontes.index)
 
 def carregar_e_consolidar_fonte(source_config: Dict[str, Any], general_config: Config) -> pd.DataFrame:
     logging.info(f"--- Iniciando coleta da fonte: {source_config['name']} ---")
@@ -326,6 +541,7 @@ def carregar_e_consolidar_fonte(source_config: Dict[str, Any], general_config: C
     list_of_dataframes = []
     
     arquivos_permitidos = source_config.get("arquivos_para_ler")
+    items_para_ler = []
 
     for item in all_items:
         if "folder" in item: continue
@@ -335,19 +551,24 @@ def carregar_e_consolidar_fonte(source_config: Dict[str, Any], general_config: C
             continue
         
         if any(keyword in file_name.lower() for keyword in general_config.KEYWORDS_TO_EXCLUDE): continue
-        
-        df = sp_client.read_excel_sheet(item['id'], file_name)
-        
-        if df is not None and not df.empty:
-            df['Fonte do Arquivo'] = file_name
-            list_of_dataframes.append(df)
-            logging.info(f"Arquivo '{file_name}' lido e adicionado.")
+        items_para_ler.append(item)
+    
+    # Downloads em paralelo (a espera é de rede); map preserva a ordem dos arquivos
+    with ThreadPoolExecutor(max_workers=general_config.MAX_WORKERS) as executor:
+        resultados = executor.map(lambda item: sp_client.read_excel_sheet(item['id'], item['name']), items_para_ler)
+    
+        for item, df in zip(items_para_ler, resultados):
+            file_name = item['name']
+            if df is not None and not df.empty:
+                df['Fonte do Arquivo'] = file_name
+                list_of_dataframes.append(df)
+                logging.info(f"Arquivo '{file_name}' lido e adicionado.")
             
     if not list_of_dataframes:
         logging.warning(f"Nenhum dado válido extraído dos arquivos da fonte '{source_config['name']}'.")
         return pd.DataFrame()
         
-    consolidated_df = pd.concat(list_of_dataframes, ignore_index=True)
+    consolidated_df = pd.concat(list_of_dataframes, ignore_index=True, copy=False)
     logging.info(f"Fonte '{source_config['name']}' consolidada. Total de {len(consolidated_df)} linhas brutas.")
     return consolidated_df
 
@@ -357,12 +578,13 @@ def processar_dados_descargas(df: pd.DataFrame, config: Config) -> pd.DataFrame:
     cfg = config.DESCARGAS_CONFIG
     
     logging.info("Verificando e tratando notas fiscais múltiplas...")
-    df['nota'] = df['nota'].astype(str)
-    df['nota'] = df['nota'].str.split('/')
-    df = df.explode('nota')
-    df['nota'] = df['nota'].str.strip()
+    # split(expand=True) + stack mantém tudo em colunas (sem listas Python intermediárias); o índice repetido
+    # por nota é o mesmo que o explode gerava
+    split_notas = df['nota'].fillna('').str.split('/', expand=True)
+    notas = split_notas.stack(future_stack=True).dropna().str.strip().rename('nota')
+    df = df.drop(columns='nota').join(notas.reset_index(level=1, drop=True))
     
-    df = df[df['produto'].astype(str).str.lower().isin(cfg['products_to_include'])]
+    df = df[_mascara_por_categoria(df['produto'], lambda c: c.str.lower().isin(cfg['products_to_include']))]
     data_limite = datetime.now() - timedelta(days=20)
     df['data'] = pd.to_datetime(df['data'], errors='coerce')
     df = df[df['data'].notna() & (df['data'] > data_limite)]
@@ -372,32 +594,23 @@ def processar_dados_descargas(df: pd.DataFrame, config: Config) -> pd.DataFrame:
     palavras_a_excluir = ['devolução', 'cancelado', 'devolvido', 'cancelada']
     regex_exclusao = '|'.join(palavras_a_excluir)
     
-    df['produto'] = df['produto'].astype(str)
-    df['status'] = df['status'].astype(str)
-
-    mask_produto = ~df['produto'].str.contains(regex_exclusao, case=False, na=False)
-    mask_status = ~df['status'].str.contains(regex_exclusao, case=False, na=False)
+    mask_produto = ~_mascara_por_categoria(df['produto'], lambda c: c.str.contains(regex_exclusao, case=False, na=False))
+    mask_status = ~_mascara_por_categoria(df['status'], lambda c: c.str.contains(regex_exclusao, case=False, na=False))
     
     df = df[mask_produto & mask_status].copy()
     logging.info(f"DataFrame de descargas filtrado. {len(df)} linhas restantes.")
     ### ALTERAÇÃO 1: FIM ###
 
     logging.info("Aplicando regra 'de-para' na fonte do arquivo para padronização.")
-    df['Fonte Padronizada'] = df['Fonte do Arquivo']
-    for key, value in config.FILENAME_MAP.items():
-        mask = df['Fonte do Arquivo'].astype(str).str.contains(key, case=False, na=False)
-        df.loc[mask, 'Fonte Padronizada'] = value
+    df['Fonte Padronizada'] = _padronizar_fonte(df['Fonte do Arquivo'], config.FILENAME_MAP)
     
     ### ALTERAÇÃO 2: INÍCIO - Criação das novas chaves ###
     # Chave Primária: nota + produto + Fonte Padronizada
-    df['chave_primaria'] = (_normalizar_texto_para_chave(df['nota']) + '_' +
-                            _normalizar_texto_para_chave(df['produto']) + '_' +
-                            _normalizar_texto_para_chave(df['Fonte Padronizada']))
+    sufixo_chave = '_' + _normalizar_texto_para_chave(df['produto']) + '_' + _normalizar_texto_para_chave(df['Fonte Padronizada'])
+    df['chave_primaria'] = _normalizar_texto_para_chave(df['nota']) + sufixo_chave
     
     # Chave Secundária (Fallback): placa + produto + Fonte Padronizada
-    df['chave_secundaria_placa'] = (_normalizar_texto_para_chave(df['placa']) + '_' +
-                                   _normalizar_texto_para_chave(df['produto']) + '_' +
-                                   _normalizar_texto_para_chave(df['Fonte Padronizada']))
+    df['chave_secundaria_placa'] = _normalizar_texto_para_chave(df['placa']) + sufixo_chave
     ### ALTERAÇÃO 2: FIM ###
     
     return df
@@ -409,25 +622,62 @@ def processar_dados_transportes(df: pd.DataFrame, config: Config) -> pd.DataFram
     
     df['status'] = df['status'].astype(str)
     status_validos = [s.lower() for s in cfg['status_para_incluir']]
-    df = df[df['status'].str.lower().isin(status_validos)].copy()
+    df = df[_mascara_por_categoria(df['status'], lambda c: c.str.lower().isin(status_validos))].copy()
 
     ### ALTERAÇÃO 3: INÍCIO - Criação das novas chaves ###
     # Chave Primária: nfe + produto + recebedor
-    df['chave_primaria'] = (_normalizar_texto_para_chave(df['nfe']) + '_' +
-                            _normalizar_texto_para_chave(df['produto']) + '_' +
-                            _normalizar_texto_para_chave(df['recebedor']))
+    sufixo_chave = '_' + _normalizar_texto_para_chave(df['produto']) + '_' + _normalizar_texto_para_chave(df['recebedor'])
+    df['chave_primaria'] = _normalizar_texto_para_chave(df['nfe']) + sufixo_chave
 
     # Chave Secundária (Fallback): cavalo + produto + recebedor
-    df['chave_secundaria_placa'] = (_normalizar_texto_para_chave(df['cavalo']) + '_' +
-                                   _normalizar_texto_para_chave(df['produto']) + '_' +
-                                   _normalizar_texto_para_chave(df['recebedor']))
+    df['chave_secundaria_placa'] = _normalizar_texto_para_chave(df['cavalo']) + sufixo_chave
     ### ALTERAÇÃO 3: FIM ###
 
     df['data_de_carregamento'] = pd.to_datetime(df['data_de_carregamento'], errors='coerce')
     
     return df
 
-def cruzar_e_atualizar_transportes(df_transportes: pd.DataFrame, df_descargas: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, int], Set[int]]:
+def _buscar_descargas(descargas_unicas: pd.DataFrame, coluna_chave: str, chaves: pd.Series, colunas: List[str]) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Localiza a descarga de cada chave com Index.get_indexer (busca por hash em C) e devolve as colunas pedidas
+    alinhadas ao índice de 'chaves' (nulas onde não houve match), junto com a máscara de match.
+    """
+    posicoes = pd.Index(descargas_unicas[coluna_chave].to_numpy()).get_indexer(chaves.to_numpy())
+    match = pd.DataFrame(
+        {col: pd.api.extensions.take(descargas_unicas[col].to_numpy(), posicoes, allow_fill=True) for col in colunas},
+        index=chaves.index
+    )
+    return match, pd.Series(posicoes >= 0, index=chaves.index)
+
+def _aplicar_transicoes(transportes: pd.DataFrame, match: pd.DataFrame, tem_match: pd.Series, etapa: str, fonte: str,
+                        contadores: Counter, indices_usados: Set[int]):
+    """Aplica em bloco (máscaras booleanas) as mudanças de status das linhas que tiveram match na etapa."""
+    indices_usados.update(match.loc[tem_match, 'original_index'].astype(int).tolist())
+    
+    status_original = transportes['status'].astype(str).str.strip().str.lower()
+    novo_status = pd.Series(np.where(match['data_de_descarga'].isna(), 'aguardando descarga', 'descarregado'), index=transportes.index)
+    mudou = tem_match & (novo_status != status_original)
+    
+    em_transito = status_original.str.contains('trânsito', regex=False)
+    aguardando = status_original.str.contains('aguardando', regex=False)
+    vai_descarregar = novo_status == 'descarregado'
+    
+    transito_para_aguardando = mudou & em_transito & ~vai_descarregar
+    transito_para_descarregado = mudou & em_transito & vai_descarregar
+    aguardando_para_descarregado = mudou & ~em_transito & aguardando & vai_descarregar
+    para_descarregado = transito_para_descarregado | aguardando_para_descarregado
+    
+    transportes.loc[mudou, 'data_chegada'] = match.loc[mudou, 'data']
+    transportes.loc[mudou, 'fonte_atualizacao'] = fonte
+    transportes.loc[transito_para_aguardando, 'status'] = 'AGUARDANDO DESCARGA'
+    transportes.loc[para_descarregado, 'data_descarga'] = match.loc[para_descarregado, 'data_de_descarga']
+    transportes.loc[para_descarregado, 'status'] = 'DESCARREGADO'
+    
+    contadores[(etapa, 'transito_para_aguardando')] += int(transito_para_aguardando.sum())
+    contadores[(etapa, 'transito_para_descarregado')] += int(transito_para_descarregado.sum())
+    contadores[(etapa, 'aguardando_para_descarregado')] += int(aguardando_para_descarregado.sum())
+
+def cruzar_e_atualizar_transportes(df_transportes: pd.DataFrame, df_descargas: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[Tuple[str, str], int], Set[int]]:
     if df_transportes.empty or df_descargas.empty:
         logging.warning("Um dos DataFrames está vazio, pulando a etapa de cruzamento.")
         return df_transportes, {}, set()
@@ -437,72 +687,37 @@ def cruzar_e_atualizar_transportes(df_transportes: pd.DataFrame, df_descargas: p
     
     indices_descargas_usados = set()
     
-    contadores = {
-        "etapa1_transito_para_aguardando": 0, "etapa1_transito_para_descarregado": 0, "etapa1_aguardando_para_descarregado": 0,
-        "etapa2_transito_para_aguardando": 0, "etapa2_transito_para_descarregado": 0, "etapa2_aguardando_para_descarregado": 0,
-    }
+    # Contadores indexados por (etapa, transição)
+    contadores = Counter()
 
     descargas_com_indice = df_descargas.copy()
     descargas_com_indice['original_index'] = descargas_com_indice.index
+    colunas_match = ['data', 'data_de_descarga', 'original_index']
 
     ### ALTERAÇÃO 4: INÍCIO - Usar a nova chave_primaria para o cruzamento ###
     descargas_unicas_primaria = descargas_com_indice.drop_duplicates(subset=['chave_primaria'], keep='last')
-    descargas_map_primaria = descargas_unicas_primaria.set_index('chave_primaria').to_dict('index')
     
     logging.info("Iniciando Etapa 1 de cruzamento (por Chave Primária: Nota + Produto + Origem/Recebedor)...")
-    for index, transporte in transportes_atualizado.iterrows():
-        match = descargas_map_primaria.get(transporte['chave_primaria'])
-        if match:
-            indices_descargas_usados.add(match['original_index'])
-            status_original = str(transporte['status']).strip().lower()
-            novo_status = 'aguardando descarga' if pd.isna(match.get('data_de_descarga')) else 'descarregado'
-
-            if novo_status != status_original:
-                transportes_atualizado.loc[index, 'data_chegada'] = match['data']
-                transportes_atualizado.loc[index, 'fonte_atualizacao'] = 'Etapa 1 - Chave Primária'
-
-                if 'trânsito' in status_original and novo_status == 'aguardando descarga':
-                    transportes_atualizado.loc[index, 'status'] = 'AGUARDANDO DESCARGA'
-                    contadores['etapa1_transito_para_aguardando'] += 1
-                elif 'trânsito' in status_original and novo_status == 'descarregado':
-                    transportes_atualizado.loc[index, 'data_descarga'] = match['data_de_descarga']
-                    transportes_atualizado.loc[index, 'status'] = 'DESCARREGADO'
-                    contadores['etapa1_transito_para_descarregado'] += 1
-                elif 'aguardando' in status_original and novo_status == 'descarregado':
-                    transportes_atualizado.loc[index, 'data_descarga'] = match['data_de_descarga']
-                    transportes_atualizado.loc[index, 'status'] = 'DESCARREGADO'
-                    contadores['etapa1_aguardando_para_descarregado'] += 1
+    match_primaria, tem_match = _buscar_descargas(descargas_unicas_primaria, 'chave_primaria', transportes_atualizado['chave_primaria'], colunas_match)
+    _aplicar_transicoes(transportes_atualizado, match_primaria, tem_match, 'etapa1', 'Etapa 1 - Chave Primária', contadores, indices_descargas_usados)
+
+    pendentes_etapa_2 = transportes_atualizado['fonte_atualizacao'] == 'Não Atualizado'
+    if not pendentes_etapa_2.any():
+        logging.info("Todos os transportes foram atualizados na Etapa 1. Etapa 2 dispensada.")
+        return transportes_atualizado, contadores, indices_descargas_usados
 
     logging.info("Iniciando Etapa 2 de cruzamento (por Chave Secundária: Placa + Produto + Origem/Recebedor)...")
     descargas_unicas_secundaria = descargas_com_indice.drop_duplicates(subset=['chave_secundaria_placa'], keep='last')
-    descargas_map_secundaria = descargas_unicas_secundaria.set_index('chave_secundaria_placa').to_dict('index')
     
-    transportes_para_etapa_2 = transportes_atualizado[transportes_atualizado['fonte_atualizacao'] == 'Não Atualizado']
-    for index, transporte in transportes_para_etapa_2.iterrows():
-        chave_busca_placa = transporte['chave_secundaria_placa']
-        match = descargas_map_secundaria.get(chave_busca_placa)
-        
-        if match:
-            if pd.notna(transporte['data_de_carregamento']) and match['data'] >= transporte['data_de_carregamento']:
-                indices_descargas_usados.add(match['original_index'])
-                status_original = str(transporte['status']).strip().lower()
-                novo_status = 'aguardando descarga' if pd.isna(match.get('data_de_descarga')) else 'descarregado'
-
-                if novo_status != status_original:
-                    transportes_atualizado.loc[index, 'data_chegada'] = match['data']
-                    transportes_atualizado.loc[index, 'fonte_atualizacao'] = 'Etapa 2 - Chave Placa'
-                    
-                    if 'trânsito' in status_original and novo_status == 'aguardando descarga':
-                        transportes_atualizado.loc[index, 'status'] = 'AGUARDANDO DESCARGA'
-                        contadores['etapa2_transito_para_aguardando'] += 1
-                    elif 'trânsito' in status_original and novo_status == 'descarregado':
-                        transportes_atualizado.loc[index, 'data_descarga'] = match['data_de_descarga']
-                        transportes_atualizado.loc[index, 'status'] = 'DESCARREGADO'
-                        contadores['etapa2_transito_para_descarregado'] += 1
-                    elif 'aguardando' in status_original and novo_status == 'descarregado':
-                        transportes_atualizado.loc[index, 'data_descarga'] = match['data_de_descarga']
-                        transportes_atualizado.loc[index, 'status'] = 'DESCARREGADO'
-                        contadores['etapa2_aguardando_para_descarregado'] += 1
+    match_secundaria, tem_match = _buscar_descargas(descargas_unicas_secundaria, 'chave_secundaria_placa', transportes_atualizado['chave_secundaria_placa'], colunas_match)
+    data_carregamento = transportes_atualizado['data_de_carregamento']
+    tem_match = (
+        pendentes_etapa_2 &
+        tem_match &
+        data_carregamento.notna() &
+        (match_secundaria['data'] >= data_carregamento)
+    )
+    _aplicar_transicoes(transportes_atualizado, match_secundaria, tem_match, 'etapa2', 'Etapa 2 - Chave Placa', contadores, indices_descargas_usados)
     ### ALTERAÇÃO 4: FIM ###
             
     return transportes_atualizado, contadores, indices_descargas_usados
@@ -510,11 +725,38 @@ def cruzar_e_atualizar_transportes(df_transportes: pd.DataFrame, df_descargas: p
 # ==============================================================================
 # 4. ORQUESTRADOR PRINCIPAL DA EXECUÇÃO
 # ==============================================================================
+def _habilitar_vt_windows() -> bool:
+    """Liga o processamento de sequências ANSI (modo VT) no console do Windows; False se não for possível."""
+    try:
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetStdHandle(-11)  # STD_OUTPUT_HANDLE
+        modo = ctypes.c_uint32()
+        if not kernel32.GetConsoleMode(handle, ctypes.byref(modo)):
+            return False
+        return bool(kernel32.SetConsoleMode(handle, modo.value | 0x0004))  # ENABLE_VIRTUAL_TERMINAL_PROCESSING
+    except Exception:
+        return False
+
+def _limpar_terminal():
+    """Limpa o terminal com sequência ANSI (sem abrir um processo de shell); no console legado do Windows usa o cls."""
+    if os.name == 'nt' and not _habilitar_vt_windows():
+        os.system('cls')
+        return
+    sys.stdout.write('\x1b[2J\x1b[H')
+    sys.stdout.flush()
+
 def main():
     try:
         logging.info("--- INICIANDO PROCESSO COMPLETO DE COLETA E ATUALIZAÇÃO ---")
         Config.validate()
         
+        # Um único instante de referência para todas as mensagens e filtros de data desta execução
+        agora = datetime.now()
+        timestamp = agora.strftime('%d/%m/%Y às %H:%M:%S')
+        timestamp_execucao = agora.strftime('%d/%m/%Y %H:%M:%S')
+        hoje = pd.Timestamp(agora.date())
+        
         raw_descargas = carregar_e_consolidar_fonte(Config.DESCARGAS_CONFIG, Config)
         df_descargas = processar_dados_descargas(raw_descargas, Config) if not raw_descargas.empty else pd.DataFrame()
         
@@ -536,9 +778,15 @@ def main():
 
         df_transportes_final, contadores_detalhados, indices_usados = cruzar_e_atualizar_transportes(df_transportes, df_descargas)
         
+        # Totais por etapa e por transição numa única passada pelos contadores
+        totais = dict.fromkeys(('etapa1', 'etapa2', 'transito_para_aguardando', 'aguardando_para_descarregado', 'transito_para_descarregado'), 0)
+        for (etapa, transicao), valor in contadores_detalhados.items():
+            totais[etapa] += valor
+            totais[transicao] += valor
+        
         sp_client_transportes = SharePointClient(Config.TRANSPORTES_CONFIG, Config)
         
-        df_updates = df_transportes_final[df_transportes_final['fonte_atualizacao'] != 'Não Atualizado'].copy()
+        df_updates = df_transportes_final[df_transportes_final['fonte_atualizacao'] != 'Não Atualizado']
 
         status_range = 'A1:W1'
         COR_VERMELHA = {'color': "#C70C21"}
@@ -549,77 +797,81 @@ def main():
             logging.info("Nenhuma atualização de status necessária. Sinalizando arquivos como 'verificados'.")
             
             if not raw_transportes.empty:
-                file_ids_para_sinalizar = set(raw_transportes['__ms_file_id'])
+                file_ids_para_sinalizar = raw_transportes['__ms_file_id'].unique().tolist()
                 sheet_name_para_aviso = raw_transportes['__ms_sheet_name'].iloc[0] 
                 
-                timestamp = datetime.now().strftime('%d/%m/%Y às %H:%M:%S')
                 msg_sem_alteracao = f"Atualizado em {timestamp}. Nenhuma alteração de status nesta execução."
 
                 logging.info(f"Sinalizando {len(file_ids_para_sinalizar)} arquivo(s) com mensagem de 'sem alterações'.")
-                for file_id in file_ids_para_sinalizar:
-                    sp_client_transportes.format_range(file_id, sheet_name_para_aviso, status_range, COR_VERDE)
-                    sp_client_transportes.update_range_value(file_id, sheet_name_para_aviso, 'A1', msg_sem_alteracao)
-                    time.sleep(1) 
+                sp_client_transportes.sinalizar_arquivos(file_ids_para_sinalizar, sheet_name_para_aviso, status_range, COR_VERDE, msg_sem_alteracao)
             else:
                 logging.info("Nenhum arquivo de Transportes foi lido, então não há onde sinalizar.")
         
         else:
-            file_ids_para_atualizar = set(df_updates['__ms_file_id'])
+            file_ids_para_atualizar = df_updates['__ms_file_id'].unique().tolist()
             sheet_name_para_aviso = df_updates['__ms_sheet_name'].iloc[0]
             
             processo_bem_sucedido = False
 
             try:
                 logging.info(f"Sinalizando {len(file_ids_para_atualizar)} arquivo(s) como 'em atualização'...")
-                for file_id in file_ids_para_atualizar:
-                    sp_client_transportes.format_range(file_id, sheet_name_para_aviso, status_range, COR_VERMELHA)
-                    sp_client_transportes.update_range_value(file_id, sheet_name_para_aviso, 'A1', "Atualizando...")
-                    time.sleep(1)
+                sp_client_transportes.sinalizar_arquivos(file_ids_para_atualizar, sheet_name_para_aviso, status_range, COR_VERMELHA, "Atualizando...")
 
                 logging.info(f"Iniciando atualização de {len(df_updates)} registros no SharePoint...")
-                for _, row in df_updates.iterrows():
-                    file_id, sheet_name, row_idx = row['__ms_file_id'], row['__ms_sheet_name'], int(row['__ms_row_index'])
+                # data_chegada, data_descarga e status são colunas vizinhas (U:W): uma linha vira um único range.
+                # As datas são formatadas de uma vez na coluna inteira; o laço só monta as linhas.
+                # data_descarga que não for data reconhecível segue como texto original
+                data_descarga = df_updates['data_descarga']
+                data_descarga_texto = pd.to_datetime(data_descarga, format='ISO8601', errors='coerce').dt.strftime('%Y-%m-%d')
+                colunas_escrita = pd.DataFrame({
+                    '__ms_file_id': df_updates['__ms_file_id'],
+                    '__ms_sheet_name': df_updates['__ms_sheet_name'],
+                    '__ms_row_index': df_updates['__ms_row_index'].astype(int),
+                    'data_chegada': pd.to_datetime(df_updates['data_chegada'], errors='coerce').dt.strftime('%Y-%m-%d'),
+                    'data_descarga': data_descarga_texto.fillna(data_descarga.astype(str)).where(data_descarga.notna()),
+                    'status': df_updates['status'],
+                }).sort_values(['__ms_file_id', '__ms_row_index'])
+                
+                # Ordenado por arquivo e linha: cada grupo já chega com as linhas em sequência para formar os blocos contíguos
+                for file_id, df_arquivo in colunas_escrita.groupby('__ms_file_id', sort=False):
+                    sheet_name = df_arquivo['__ms_sheet_name'].iloc[0]
+                    
+                    # Nulos viram None (célula mantida pelo Graph) numa única máscara
+                    valores = df_arquivo[['data_chegada', 'data_descarga', 'status']].astype(object)
+                    linhas_para_escrever = valores.where(valores.notna(), None).to_numpy().tolist()
                     
-                    sp_client_transportes.update_cell(file_id, sheet_name, row_idx, 'status', row['status'])
-                    if pd.notna(row['data_chegada']):
-                        sp_client_transportes.update_cell(file_id, sheet_name, row_idx, 'data_chegada', row['data_chegada'].strftime('%Y-%m-%d'))
-                    if pd.notna(row['data_descarga']):
-                        if isinstance(row['data_descarga'], (datetime, pd.Timestamp)):
-                            sp_client_transportes.update_cell(file_id, sheet_name, row_idx, 'data_descarga', row['data_descarga'].strftime('%Y-%m-%d'))
-                        else:
-                            sp_client_transportes.update_cell(file_id, sheet_name, row_idx, 'data_descarga', str(row['data_descarga']))
+                    session_id = sp_client_transportes.create_workbook_session(file_id)
+                    try:
+                        sp_client_transportes.batch_update_rows(file_id, sheet_name, df_arquivo['__ms_row_index'].tolist(),
+                                                                linhas_para_escrever, 'data_chegada', session_id)
+                    finally:
+                        if session_id:
+                            sp_client_transportes.close_workbook_session(file_id, session_id)
                 
                 logging.info("✅ SUCESSO! Atualizações no SharePoint concluídas.")
                 processo_bem_sucedido = True
 
             except Exception as e:
                 logging.critical(f"❌ UM ERRO OCORREU DURANTE AS ATUALIZAÇÕES: {e}", exc_info=True)
-                for file_id in file_ids_para_atualizar:
-                    sp_client_transportes.format_range(file_id, sheet_name_para_aviso, status_range, COR_AMARELA)
-                    msg_erro = f"Falha na atualização. Verifique os logs. Detalhe: {str(e)[:150]}"
-                    sp_client_transportes.update_range_value(file_id, sheet_name_para_aviso, 'A1', msg_erro)
-                    time.sleep(1)
+                msg_erro = f"Falha na atualização. Verifique os logs. Detalhe: {str(e)[:150]}"
+                sp_client_transportes.sinalizar_arquivos(file_ids_para_atualizar, sheet_name_para_aviso, status_range, COR_AMARELA, msg_erro)
                 raise
 
             finally:
                 if processo_bem_sucedido:
                     logging.info("Sinalizando arquivos como 'atualização concluída'.")
                     
-                    total_t_ad = sum(v for k, v in contadores_detalhados.items() if 'transito_para_aguardando' in k)
-                    total_ad_d = sum(v for k, v in contadores_detalhados.items() if 'aguardando_para_descarregado' in k)
-                    total_t_d = sum(v for k, v in contadores_detalhados.items() if 'transito_para_descarregado' in k)
+                    total_t_ad = totais['transito_para_aguardando']
+                    total_ad_d = totais['aguardando_para_descarregado']
+                    total_t_d = totais['transito_para_descarregado']
                     
-                    timestamp = datetime.now().strftime('%d/%m/%Y às %H:%M:%S')
                     msg_sucesso = (f"Atualizado em {timestamp}. "
                                    f"Status alterados: {total_t_ad} (Trânsito -> Aguardando), "
                                    f"{total_ad_d + total_t_d} (-> Descarregado)")
 
-                    for file_id in file_ids_para_atualizar:
-                        sp_client_transportes.format_range(file_id, sheet_name_para_aviso, status_range, COR_VERDE)
-                        sp_client_transportes.update_range_value(file_id, sheet_name_para_aviso, 'A1', msg_sucesso)
-                        time.sleep(1)
+                    sp_client_transportes.sinalizar_arquivos(file_ids_para_atualizar, sheet_name_para_aviso, status_range, COR_VERDE, msg_sucesso)
 
-        os.system('cls' if os.name == 'nt' else 'clear')
+        _limpar_terminal()
         
         print("\n" + "="*80)
         print("                        RESULTADO FINAL - DADOS DE TRANSPORTE ATUALIZADOS")
@@ -631,68 +883,68 @@ def main():
             print("-" * 80)
             print("                                        RELATÓRIO DE MUDANÇAS DE STATUS REAIS")
             print("-" * 80)
-            total_etapa1 = sum(v for k, v in contadores_detalhados.items() if k.startswith('etapa1'))
-            total_etapa2 = sum(v for k, v in contadores_detalhados.items() if k.startswith('etapa2'))
+            total_etapa1 = totais['etapa1']
+            total_etapa2 = totais['etapa2']
             print(f"Etapa 1 (Chave Primária): {total_etapa1} atualizações reais")
-            print(f"  - 'Em Trânsito' -> 'Aguardando Descarga': {contadores_detalhados.get('etapa1_transito_para_aguardando', 0)}")
-            print(f"  - 'Em Trânsito' -> 'Descarregado': {contadores_detalhados.get('etapa1_transito_para_descarregado', 0)}")
-            print(f"  - 'Aguardando Descarga' -> 'Descarregado': {contadores_detalhados.get('etapa1_aguardando_para_descarregado', 0)}")
+            print(f"  - 'Em Trânsito' -> 'Aguardando Descarga': {contadores_detalhados.get(('etapa1', 'transito_para_aguardando'), 0)}")
+            print(f"  - 'Em Trânsito' -> 'Descarregado': {contadores_detalhados.get(('etapa1', 'transito_para_descarregado'), 0)}")
+            print(f"  - 'Aguardando Descarga' -> 'Descarregado': {contadores_detalhados.get(('etapa1', 'aguardando_para_descarregado'), 0)}")
             print("-" * 80)
             print(f"Etapa 2 (Chave Placa): {total_etapa2} atualizações reais")
-            print(f"  - 'Em Trânsito' -> 'Aguardando Descarga': {contadores_detalhados.get('etapa2_transito_para_aguardando', 0)}")
-            print(f"  - 'Em Trânsito' -> 'Descarregado': {contadores_detalhados.get('etapa2_transito_para_descarregado', 0)}")
-            print(f"  - 'Aguardando Descarga' -> 'Descarregado': {contadores_detalhados.get('etapa2_aguardando_para_descarregado', 0)}")
+            print(f"  - 'Em Trânsito' -> 'Aguardando Descarga': {contadores_detalhados.get(('etapa2', 'transito_para_aguardando'), 0)}")
+            print(f"  - 'Em Trânsito' -> 'Descarregado': {contadores_detalhados.get(('etapa2', 'transito_para_descarregado'), 0)}")
+            print(f"  - 'Aguardando Descarga' -> 'Descarregado': {contadores_detalhados.get(('etapa2', 'aguardando_para_descarregado'), 0)}")
             print("-" * 80)
             print(f"Total de ATUALIZAÇÕES REAIS: {total_etapa1 + total_etapa2}")
 
         # ===== SEÇÃO DO RELATÓRIO DE DIVERGÊNCIAS =====
         logging.info("Iniciando a geração do relatório de divergências...")
-        sp_client_relatorio = SharePointClient(Config.RELATORIO_DIVERGENCIA_CONFIG, Config)
-
         if not df_descargas.empty:
-            df_descargas_nao_usadas = df_descargas.drop(index=list(indices_usados))
-            
-            hoje_str = datetime.now().strftime('%Y-%m-%d')
-            raw_transportes['data_descarga'] = pd.to_datetime(raw_transportes['data_descarga'], errors='coerce')
+            # Células de data chegam como datetime; textos são os 'AAAA-MM-DD' gravados por este script (formato fixo, sem dateutil)
+            raw_transportes['data_descarga'] = pd.to_datetime(raw_transportes['data_descarga'], format='ISO8601', errors='coerce', cache=True)
 
             df_descarregados_hoje = raw_transportes[
                 (raw_transportes['status'].str.lower() == 'descarregado') &
-                (raw_transportes['data_descarga'].dt.strftime('%Y-%m-%d') == hoje_str)
-            ].copy()
+                raw_transportes['data_descarga'].dt.normalize().eq(hoje)
+            ]
 
-            chaves_descarregadas_hoje_primaria = set()
-            chaves_descarregadas_hoje_secundaria = set()
+            # Chaves únicas em arrays (hashtable do pandas), consumidas direto pelo isin
+            chaves_descarregadas_hoje_primaria = np.array([], dtype=object)
+            chaves_descarregadas_hoje_secundaria = np.array([], dtype=object)
 
             ### ALTERAÇÃO 5: INÍCIO - Usar novas chaves para o relatório de divergência ###
             if not df_descarregados_hoje.empty:
-                df_descarregados_hoje['chave_primaria'] = (_normalizar_texto_para_chave(df_descarregados_hoje['nfe']) + '_' +
-                                                          _normalizar_texto_para_chave(df_descarregados_hoje['produto']) + '_' +
-                                                          _normalizar_texto_para_chave(df_descarregados_hoje['recebedor']))
-                chaves_descarregadas_hoje_primaria = set(df_descarregados_hoje['chave_primaria'])
-                
-                df_descarregados_hoje['chave_secundaria_placa'] = (_normalizar_texto_para_chave(df_descarregados_hoje['cavalo']) + '_' +
-                                                                   _normalizar_texto_para_chave(df_descarregados_hoje['produto']) + '_' +
-                                                                   _normalizar_texto_para_chave(df_descarregados_hoje['recebedor']))
-                chaves_descarregadas_hoje_secundaria = set(df_descarregados_hoje['chave_secundaria_placa'])
-
-            df_descargas_nao_usadas['data_de_descarga'] = pd.to_datetime(df_descargas_nao_usadas['data_de_descarga'], errors='coerce')
-            hoje = datetime.now().date()
+                # Cada coluna é normalizada uma única vez e as chaves saem de um str.cat
+                norm = {col: _normalizar_texto_para_chave(df_descarregados_hoje[col]) for col in ('nfe', 'produto', 'recebedor', 'cavalo')}
+                # Chaves calculadas à parte: o recorte de raw_transportes é só lido, nunca escrito
+                chaves_descarregadas_hoje_primaria = pd.unique(norm['nfe'].str.cat([norm['produto'], norm['recebedor']], sep='_').to_numpy(dtype=object))
+                chaves_descarregadas_hoje_secundaria = pd.unique(norm['cavalo'].str.cat([norm['produto'], norm['recebedor']], sep='_').to_numpy(dtype=object))
+
+            # Todos os filtros baratos viram uma única máscara sobre df_descargas; o recorte é materializado uma vez só.
+            # Máscara de não usadas pelos rótulos (o índice repete rótulos após a separação das notas, como no drop)
+            # Planilhas de Descargas são digitadas à mão (dd/mm/aaaa); exact=False aceita também a hora após a data
+            data_de_descarga = pd.to_datetime(df_descargas['data_de_descarga'], format='%d/%m/%Y', exact=False, errors='coerce', cache=True)
+            filtro_data = data_de_descarga.isna() | data_de_descarga.dt.normalize().eq(hoje)
+            mascara_relatorio = filtro_data & ~df_descargas.index.isin(indices_usados)
+
+            # Sem descarregados hoje não há chave a excluir: os filtros de chave são dispensados
+            tem_chaves_hoje = len(chaves_descarregadas_hoje_primaria) > 0 or len(chaves_descarregadas_hoje_secundaria) > 0
+            if tem_chaves_hoje:
+                filtro_primaria_nao_encontrada = ~df_descargas['chave_primaria'].isin(chaves_descarregadas_hoje_primaria)
+                filtro_secundaria_nao_encontrada = ~df_descargas['chave_secundaria_placa'].isin(chaves_descarregadas_hoje_secundaria)
+                mascara_relatorio &= filtro_primaria_nao_encontrada & filtro_secundaria_nao_encontrada
             
-            filtro_data = (df_descargas_nao_usadas['data_de_descarga'].isna()) | (df_descargas_nao_usadas['data_de_descarga'].dt.date == hoje)
-            df_relatorio = df_descargas_nao_usadas[filtro_data].copy()
-
-            if not df_relatorio.empty:
-                filtro_primaria_nao_encontrada = ~df_relatorio['chave_primaria'].isin(chaves_descarregadas_hoje_primaria)
-                filtro_secundaria_nao_encontrada = ~df_relatorio['chave_secundaria_placa'].isin(chaves_descarregadas_hoje_secundaria)
-                df_relatorio = df_relatorio[filtro_primaria_nao_encontrada & filtro_secundaria_nao_encontrada]
+            df_relatorio = df_descargas[mascara_relatorio].assign(data_de_descarga=data_de_descarga[mascara_relatorio].to_numpy())
             ### ALTERAÇÃO 5: FIM ###
 
             df_relatorio_final = pd.DataFrame()
             if not df_relatorio.empty:
                 # FILTRO: Hidratado (Case Insensitive)
                 termo_busca = 'hidratado'
-                filtro_produto = df_relatorio['produto'].astype(str).str.contains(termo_busca, case=False, na=False)
-                df_relatorio_final = df_relatorio[filtro_produto]
+                # Busca literal (sem regex), só nas linhas que sobraram dos filtros anteriores
+                filtro_produto = df_relatorio['produto'].astype(STRING_DTYPE).str.lower().str.contains(termo_busca, regex=False, na=False)
+                if filtro_produto.any():
+                    df_relatorio_final = df_relatorio[filtro_produto]
             
             if not df_relatorio_final.empty:
                 logging.info(f"Encontradas {len(df_relatorio_final)} linhas para o relatório de divergências.")
@@ -701,19 +953,20 @@ def main():
                     'produto': 'Produto', 'Fonte Padronizada': 'Origem Descarga', 'status': 'Status Descarga',
                     'data_de_descarga': 'Data de Descarga','empresa': 'empresa'
                 }
-                df_para_escrever = df_relatorio_final[list(colunas_relatorio.keys())].rename(columns=colunas_relatorio)
-                
-                # USO DO NOVO MÉTODO ROBUSTO (BASEADO NO SCRIPT PARALELO)
-                sp_client_relatorio.update_specific_sheet(df_para_escrever, sheet_name_target='Divergencias')
+                # Monta o relatório direto das colunas de origem (sem projeção intermediária + cópia renomeada)
+                df_para_escrever = pd.DataFrame({destino: df_relatorio_final[origem].to_numpy() for origem, destino in colunas_relatorio.items()})
 
             else:
                 logging.info("Nenhuma divergência encontrada para o relatório.")
-                df_vazio = pd.DataFrame(columns=[f"Nenhuma divergência de Hidratado encontrada na execução de {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}."])
-                sp_client_relatorio.update_specific_sheet(df_vazio, sheet_name_target='Divergencias')
+                df_para_escrever = pd.DataFrame(columns=[f"Nenhuma divergência de Hidratado encontrada na execução de {timestamp_execucao}."])
         else:
             logging.info("Fonte de Descargas vazia, pulando relatório de divergências.")
-            df_vazio = pd.DataFrame(columns=[f"Fonte de descargas vazia. Execução de {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}."])
-            sp_client_relatorio.update_specific_sheet(df_vazio, sheet_name_target='Divergencias')
+            df_para_escrever = pd.DataFrame(columns=[f"Fonte de descargas vazia. Execução de {timestamp_execucao}."])
+
+        # Cliente do relatório criado só no ponto de escrita (um único caminho, depois de todo o processamento)
+        sp_client_relatorio = SharePointClient(Config.RELATORIO_DIVERGENCIA_CONFIG, Config)
+        # USO DO NOVO MÉTODO ROBUSTO (BASEADO NO SCRIPT PARALELO)
+        sp_client_relatorio.update_specific_sheet(df_para_escrever, sheet_name_target='Divergencias')
         
         print("="*80)
         print("                RELATÓRIO DE DIVERGÊNCIAS GERADO NO SHAREPOINT")
@@ -12,16 +12,21 @@ Sheets e gera um relatório de divergências.
 import re
 import os
 import io
+import json
 import sys
-import time
 import logging
+import threading
 import pandas as pd
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Tuple, Set
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import warnings
 
 # ==============================================================================
@@ -29,6 +34,18 @@ import warnings
 # ==============================================================================
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 warnings.filterwarnings('ignore', category=UserWarning, module='openpyxl')
+
+# Strings Arrow quando o pyarrow estiver disponível (kernels vetorizados em C); senão, o dtype 'string' nativo
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    STRING_DTYPE = 'string[pyarrow]'
+except ImportError:
+    pa = pc = None
+    STRING_DTYPE = 'string'
+
+_KEY_RE = re.compile('[^a-z0-9]')
+
 load_dotenv()
 
 class Config:
@@ -54,7 +71,7 @@ class Config:
         "folder_path": "Bases",
         "sheet_name": "Descarga",
         "header": ['faturista', 'produto', 'origem', 'empresa', 'data', 'hora', 'placa', 'motorista', 'nota', 'quantidade_nf', 'op_tanque', 'aditivar', 'aditivo', 'dias_em_espera', 'status', 'data_de_descarga', 'hr_entrada'],
-        "products_to_include": ['anidro', 'hidratado', 'biodiesel', 'gasolina a', 'gasolina c', 'diesel a s10', 'diesel b s10', 'diesel a s500', 'diesel b s500', 'mgo']
+        "products_to_include": frozenset(['anidro', 'hidratado', 'biodiesel', 'gasolina a', 'gasolina c', 'diesel a s10', 'diesel b s10', 'diesel a s500', 'diesel b s500', 'mgo'])
     }
 
     GOOGLE_SHEETS_CONFIG: Dict[str, Any] = {
@@ -68,13 +85,20 @@ class Config:
         "header": ["sm", "data_prev_carregamento", "expedidor", "cidade_origem", "ufo", "destinatario", "recebedor", "cidade_destino", "ufd", "produto", "motorista", "cavalo", "carreta1", "carreta2", "transportadora", "nfe", "volume_l", "data_de_carregamento", "horario_de_carregamento", "data_chegada", "data_descarga", "status"],
         "status_para_incluir": ["Em Trânsito", "Aguardando Descarga", "Em Trânsito By Pass", "Aguardando By Pass"]
     }
+    # Status válidos já em minúsculas, calculados uma vez na carga da classe
+    STATUS_VALIDOS: frozenset = frozenset(status.lower() for status in GOOGLE_SHEETS_CONFIG["status_para_incluir"])
     
     RELATORIO_DIVERGENCIA_CONFIG: Dict[str, Any] = {
         "url": "https://docs.google.com/spreadsheets/d/1Il5VDZUuEbKVf78ne1QdRqbRyHrd1EFXc3VRhU-2Wmo/edit?usp=sharing",
         "sheet_name": "Página1"
     }
 
+    MAX_WORKERS: int = 8 # Downloads simultâneos do SharePoint
+    LIMIAR_CHAVES_EM_PARALELO: int = 50_000 # Linhas de Descargas a partir das quais as chaves são montadas em vários processos
+    # IDs de site/biblioteca reaproveitados entre execuções (o token do Graph não é gravado)
+    GRAPH_CACHE_PATH: str = os.path.join(os.path.expanduser("~"), ".cache", "drive_sheets_graph.json")
     KEYWORDS_TO_EXCLUDE: List[str] = ["backup", "modelo", "corrompida", "corrompido", "dinamica"]
+    KEYWORDS_TO_EXCLUDE_RE: re.Pattern = re.compile('|'.join(re.escape(keyword) for keyword in KEYWORDS_TO_EXCLUDE), re.IGNORECASE)
     FILENAME_MAP: Dict[str, str] = {
         "ARUJA": "Aruja", "BARRA_MANSA": "Barra Mansa", "BCAG": "BCAG", "CAVALINI": "Cavalini", "CROSS": "Cross Terminais", "DIRECIONAL_FILIAL": "Direcional Filial",
         "DIRECIONAL_MATRIZ": "Direcional Matriz", "FLAG": "Flag", "GRANEL_QUIMICA": "Granel Química", "MANGUINHOS": "Caxias", "PETRONORTE": "Petronorte", "REFIT_BASE": "Refit",
@@ -91,60 +115,153 @@ class Config:
             raise ValueError("❌ Arquivo de credenciais do Google Sheets não encontrado.")
         logging.info("Configurações de ambiente carregadas.")
 
+# Máximo de sub-requisições aceitas pelo endpoint $batch do Graph
+GRAPH_BATCH_LIMIT = 20
+# Projeção dos metadados do item: só o necessário para baixar o arquivo (o downloadUrl precisa ser pedido explicitamente)
+DOWNLOAD_URL_SELECT = "$select=id,@microsoft.graph.downloadUrl"
+
+def _ler_cache_graph() -> Dict[str, Any]:
+    try:
+        with open(Config.GRAPH_CACHE_PATH, encoding='utf-8') as arquivo:
+            cache = json.load(arquivo)
+    except (OSError, ValueError):
+        return {}
+    # Versões anteriores gravavam o token no arquivo: remove na primeira leitura
+    if any(chave.startswith('token:') for chave in cache):
+        cache = {chave: valor for chave, valor in cache.items() if not chave.startswith('token:')}
+        _gravar_cache_graph(cache)
+    return cache
+
+def _gravar_cache_graph(cache: Dict[str, Any]):
+    """Grava o cache num arquivo temporário e troca de uma vez (uma falha de escrita nunca interrompe o processo)."""
+    try:
+        os.makedirs(os.path.dirname(Config.GRAPH_CACHE_PATH), mode=0o700, exist_ok=True)
+        caminho_temporario = Config.GRAPH_CACHE_PATH + '.tmp'
+        # Arquivo legível só pelo dono, independente do umask
+        descritor = os.open(caminho_temporario, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descritor, 'w', encoding='utf-8') as arquivo:
+            json.dump(cache, arquivo)
+        os.chmod(caminho_temporario, 0o600)
+        os.replace(caminho_temporario, Config.GRAPH_CACHE_PATH)
+    except OSError as e:
+        logging.warning(f"Não foi possível gravar o cache do Graph: {e}")
+
 class SharePointClient:
     def __init__(self, site_config: Dict[str, Any]):
         self.site_config = site_config
+        # Sessão com keep-alive (um handshake TLS por host) e novas tentativas para limitação/erros transitórios do Graph
+        self.session = requests.Session()
+        retry = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._cache = _ler_cache_graph()
+        self._ids_do_cache = False
         self.access_token = self._get_access_token()
+        try:
+            self._resolver_ids()
+        except requests.exceptions.HTTPError as e:
+            # Site/biblioteca vindos do cache podem ter mudado: descarta e resolve de novo uma vez
+            if e.response is None or e.response.status_code != 404 or not self._ids_do_cache:
+                raise
+            self._descartar_ids_em_cache()
+            self._resolver_ids()
+    def _resolver_ids(self):
         self.site_id = self._get_site_id()
         self.drive_id = self._get_drive_id()
+        if self._ids_do_cache:
+            # Confirma os IDs do cache numa chamada leve: se ficaram obsoletos, o 404 sai aqui e não no meio da coleta
+            self._api_request('get', f"https://graph.microsoft.com/v1.0/sites/{self.site_id}/drives/{self.drive_id}?$select=id")
+    def _descartar_ids_em_cache(self):
+        self._cache.pop(f"site:{Config.HOSTNAME}:{self.site_config['site_path']}", None)
+        self._cache.pop(f"drive:{getattr(self, 'site_id', None)}:{self.site_config['drive_name'].lower()}", None)
+        self._ids_do_cache = False
+        _gravar_cache_graph(self._cache)
     def _api_request(self, method: str, url: str, json: Dict = None) -> Dict[str, Any]:
         headers = {"Authorization": f"Bearer {self.access_token}"}
-        response = requests.request(method, url, headers=headers, json=json)
+        response = self.session.request(method, url, headers=headers, json=json)
         response.raise_for_status()
         return response.json() if response.content else None
     def _get_access_token(self) -> str:
         url = f"https://login.microsoftonline.com/{Config.TENANT_ID}/oauth2/v2.0/token"
         data = {"client_id": Config.CLIENT_ID, "scope": "https://graph.microsoft.com/.default", "client_secret": Config.CLIENT_SECRET, "grant_type": "client_credentials"}
-        response = requests.post(url, data=data)
+        response = self.session.post(url, data=data)
         response.raise_for_status()
         return response.json()["access_token"]
     def _get_site_id(self) -> str:
-        url = f"https://graph.microsoft.com/v1.0/sites/{Config.HOSTNAME}:{self.site_config['site_path']}"
-        return self._api_request('get', url)["id"]
+        cache_key = f"site:{Config.HOSTNAME}:{self.site_config['site_path']}"
+        if cache_key in self._cache:
+            self._ids_do_cache = True
+        else:
+            url = f"https://graph.microsoft.com/v1.0/sites/{Config.HOSTNAME}:{self.site_config['site_path']}"
+            self._cache[cache_key] = self._api_request('get', url)["id"]
+            _gravar_cache_graph(self._cache)
+        return self._cache[cache_key]
     def _get_drive_id(self) -> str:
+        drive_name_lower = self.site_config['drive_name'].lower()
+        cache_key = f"drive:{self.site_id}:{drive_name_lower}"
+        if cache_key in self._cache:
+            self._ids_do_cache = True
+            return self._cache[cache_key]
         url = f"https://graph.microsoft.com/v1.0/sites/{self.site_id}/drives"
         drives = self._api_request('get', url).get("value", [])
-        drive_name_lower = self.site_config['drive_name'].lower()
         for drive in drives:
             if drive['name'].lower() == drive_name_lower:
+                self._cache[cache_key] = drive['id']
+                _gravar_cache_graph(self._cache)
                 return drive['id']
         raise FileNotFoundError(f"Biblioteca '{self.site_config['drive_name']}' não encontrada.")
     def get_files_in_folder(self) -> List[Dict[str, Any]]:
         path_segment = f"/root:/{requests.utils.quote(self.site_config['folder_path'])}:" if self.site_config['folder_path'] else "/root"
         url = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}{path_segment}/children"
         return self._api_request('get', url).get("value", [])
-    def read_excel_sheet(self, file_id: str, file_name: str) -> pd.DataFrame | None:
+    def get_download_urls_batch(self, file_ids: List[str]) -> Dict[str, str]:
+        """Busca o downloadUrl de vários arquivos pelo endpoint $batch do Graph (até 20 itens por chamada)."""
+        download_urls = {}
+        for inicio in range(0, len(file_ids), GRAPH_BATCH_LIMIT):
+            lote = file_ids[inicio:inicio + GRAPH_BATCH_LIMIT]
+            body = {"requests": [{"id": str(i), "method": "GET", "url": f"/drives/{self.drive_id}/items/{file_id}?{DOWNLOAD_URL_SELECT}"} for i, file_id in enumerate(lote)]}
+            resposta = self._api_request('post', "https://graph.microsoft.com/v1.0/$batch", json=body)
+            for sub_resposta in resposta.get('responses', []):
+                file_id = lote[int(sub_resposta['id'])]
+                download_url = (sub_resposta.get('body') or {}).get('@microsoft.graph.downloadUrl')
+                if sub_resposta.get('status') == 200 and download_url:
+                    download_urls[file_id] = download_url
+                else:
+                    logging.warning(f"downloadUrl não obtido pelo $batch para o item {file_id} (HTTP {sub_resposta.get('status')}).")
+        return download_urls
+    def read_excel_sheet(self, file_id: str, file_name: str, download_url: str = None) -> pd.DataFrame | None:
         try:
-            url_item = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}"
-            download_url = self._api_request('get', url_item).get('@microsoft.graph.downloadUrl')
+            if not download_url:
+                url_item = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}?{DOWNLOAD_URL_SELECT}"
+                download_url = self._api_request('get', url_item).get('@microsoft.graph.downloadUrl')
             if not download_url:
                 return None
-            response_content = requests.get(download_url, timeout=60)
-            response_content.raise_for_status()
-            xls = pd.ExcelFile(io.BytesIO(response_content.content))
-            sheet_name_to_find = self.site_config['sheet_name'].lower()
-            actual_sheet_name = next((s for s in xls.sheet_names if s.lower() == sheet_name_to_find), None)
-            if actual_sheet_name:
-                df = pd.read_excel(xls, sheet_name=actual_sheet_name, header=None)
-                header_list = self.site_config['header']
-                header_keyword = 'produto'
-                for i, row in df.head(15).iterrows():
-                    if any(str(cell).strip().lower() == header_keyword for cell in row):
-                        df_data = df.iloc[i + 1:].copy()
-                        num_expected_cols = len(header_list)
-                        df_data = df_data.iloc[:, :num_expected_cols]
-                        df_data.columns = header_list
-                        return df_data.reset_index(drop=True)
+            # Download em blocos direto para a memória: o calamine carrega o arquivo inteiro de qualquer forma,
+            # então um arquivo temporário só acrescentaria cópia sem reduzir o pico de memória
+            with io.BytesIO() as buffer:
+                with self.session.get(download_url, stream=True, timeout=60) as response_content:
+                    response_content.raise_for_status()
+                    for chunk in response_content.iter_content(chunk_size=64 * 1024):
+                        buffer.write(chunk)
+                buffer.seek(0)
+                # Leitor em Rust (python-calamine): bem mais rápido que o openpyxl para planilhas grandes
+                xls = pd.ExcelFile(buffer, engine='calamine')
+                sheet_name_to_find = self.site_config['sheet_name'].lower()
+                actual_sheet_name = next((s for s in xls.sheet_names if s.lower() == sheet_name_to_find), None)
+                if actual_sheet_name:
+                    # Sonda só as 15 primeiras linhas atrás do cabeçalho; a leitura completa já começa nos dados.
+                    # dtype=object mantém os valores das células como na leitura antiga (sem inferência por coluna)
+                    probe = pd.read_excel(xls, sheet_name=actual_sheet_name, header=None, nrows=15, dtype=object)
+                    header_list = self.site_config['header']
+                    header_keyword = 'produto'
+                    # Comparação única na matriz da sonda: primeira linha com alguma célula igual à palavra-chave
+                    celulas = np.char.lower(np.char.strip(probe.to_numpy(dtype=str)))
+                    linhas_cabecalho = np.flatnonzero((celulas == header_keyword).any(axis=1))
+                    if linhas_cabecalho.size:
+                        i = int(linhas_cabecalho[0])
+                        return pd.read_excel(xls, sheet_name=actual_sheet_name, header=None, skiprows=i + 1,
+                                             usecols=range(len(header_list)), names=header_list, dtype=object)
             return None
         except Exception as e:
             logging.error(f"Falha ao ler o arquivo {file_name} (ID: {file_id}). Erro: {e}")
@@ -164,7 +281,10 @@ class GoogleSheetsClient:
         try:
             spreadsheet = self.client.open_by_url(spreadsheet_url)
             sheet = spreadsheet.worksheet(sheet_name)
-            all_data = sheet.get_all_values()
+            # Só as colunas do cabeçalho e valores não formatados (datas como número serial): resposta menor e sem
+            # formatação de locale no servidor. Linhas vêm sem as células vazias do fim, o DataFrame completa com None
+            faixa = f"A1:{gspread.utils.rowcol_to_a1(sheet.row_count, len(header_config))}"
+            all_data = sheet.get(faixa, value_render_option='UNFORMATTED_VALUE', date_time_render_option='SERIAL_NUMBER')
             header_keyword = 'sm'
             header_row_index = -1
             for i, row in enumerate(all_data[:15]):
@@ -191,38 +311,43 @@ class GoogleSheetsClient:
         except Exception as e:
             logging.error(f"Erro ao ler dados do Google Sheets: {e}")
             return pd.DataFrame()
+    # Cores do painel de status (linha 1 da planilha)
+    BANNER_COLORS: Dict[str, Dict[str, float]] = {"RED": {"red": 0.9, "green": 0.2, "blue": 0.2}, "YELLOW": {"red": 1.0, "green": 0.9, "blue": 0.4}, "GREEN": {"red": 0.2, "green": 0.7, "blue": 0.2}}
+    def _banner_requests(self, sheet_id: int, message: str, color: str) -> List[Dict[str, Any]]:
+        """Requisições do batchUpdate que pintam a linha 1 e escrevem a mensagem em A1."""
+        format_request = {"repeatCell": {"range": {"sheetId": sheet_id, "startRowIndex": 0, "endRowIndex": 1, "startColumnIndex": 0, "endColumnIndex": 22}, "cell": {"userEnteredFormat": {"backgroundColor": self.BANNER_COLORS.get(color, {"red": 1})}}, "fields": "userEnteredFormat.backgroundColor"}}
+        message_request = {"updateCells": {"range": {"sheetId": sheet_id, "startRowIndex": 0, "endRowIndex": 1, "startColumnIndex": 0, "endColumnIndex": 1}, "rows": [{"values": [{"userEnteredValue": {"stringValue": message}}]}], "fields": "userEnteredValue"}}
+        return [format_request, message_request]
     def update_status_banner(self, spreadsheet_url: str, sheet_name: str, message: str, color: str):
         try:
             spreadsheet = self.client.open_by_url(spreadsheet_url)
             sheet = spreadsheet.worksheet(sheet_name)
-            colors = {"RED": {"red": 0.9, "green": 0.2, "blue": 0.2}, "YELLOW": {"red": 1.0, "green": 0.9, "blue": 0.4}, "GREEN": {"red": 0.2, "green": 0.7, "blue": 0.2}}
-            format_request = {"repeatCell": {"range": {"sheetId": sheet.id, "startRowIndex": 0, "endRowIndex": 1, "startColumnIndex": 0, "endColumnIndex": 22}, "cell": {"userEnteredFormat": {"backgroundColor": colors.get(color, {"red": 1})}}, "fields": "userEnteredFormat.backgroundColor"}}
-            spreadsheet.batch_update({"requests": [format_request]})
-            sheet.update_acell('A1', message)
+            spreadsheet.batch_update({"requests": self._banner_requests(sheet.id, message, color)})
             logging.info(f"Painel de status atualizado em '{spreadsheet.title}': {message}")
         except Exception as e:
             logging.error(f"Erro ao atualizar o painel de status no Google Sheets: {e}")
-    def batch_update_data(self, spreadsheet_url: str, sheet_name: str, updates_df: pd.DataFrame, header_config: list):
+    def commit_all(self, spreadsheet_url: str, sheet_name: str, banner_message: str, color: str, updates_df: pd.DataFrame, header_config: list):
+        """
+        Grava as células alteradas e o painel de status da planilha num único batchUpdate (aplicado por inteiro ou não aplicado).
+        Cada célula vai como pasteData, que interpreta o texto como digitado pelo usuário (equivalente ao USER_ENTERED).
+        """
         try:
             spreadsheet = self.client.open_by_url(spreadsheet_url)
             sheet = spreadsheet.worksheet(sheet_name)
-            cell_updates = []
+            all_requests = self._banner_requests(sheet.id, banner_message, color)
             cols_to_update = ['status', 'data_chegada', 'data_descarga']
-            for _, row in updates_df.iterrows():
-                row_idx = row['__gs_row_index']
-                for col_name in cols_to_update:
-                    if col_name in row and pd.notna(row[col_name]):
-                        value = row[col_name]
-                        if isinstance(value, (datetime, pd.Timestamp)):
-                            value = value.strftime('%d/%m/%Y')
-                        col_idx = header_config.index(col_name) + 1
-                        cell = gspread.Cell(row=row_idx, col=col_idx, value=str(value))
-                        cell_updates.append(cell)
-            if cell_updates:
-                sheet.update_cells(cell_updates, value_input_option='USER_ENTERED')
-                logging.info(f"{len(cell_updates)} células de dados atualizadas em lote em '{spreadsheet.title}'.")
+            for col_name in cols_to_update:
+                col_idx = header_config.index(col_name)
+                preenchidos = updates_df[col_name].notna()
+                for row_idx, value in zip(updates_df.loc[preenchidos, '__gs_row_index'], updates_df.loc[preenchidos, col_name]):
+                    if isinstance(value, (datetime, pd.Timestamp)):
+                        value = value.strftime('%d/%m/%Y')
+                    all_requests.append({"pasteData": {"coordinate": {"sheetId": sheet.id, "rowIndex": int(row_idx) - 1, "columnIndex": col_idx}, "data": str(value), "type": "PASTE_NORMAL", "delimiter": "\t"}})
+            spreadsheet.batch_update({"requests": all_requests})
+            logging.info(f"{len(all_requests) - 2} células de dados e o painel de status atualizados em '{spreadsheet.title}': {banner_message}")
         except Exception as e:
-            logging.error(f"Erro na atualização em lote de dados no Google Sheets: {e}")
+            logging.error(f"Erro na atualização em lote no Google Sheets: {e}")
+            raise
     def clear_and_write_dataframe(self, spreadsheet_url: str, sheet_name: str, df_to_write: pd.DataFrame):
             try:
                 spreadsheet = self.client.open_by_url(spreadsheet_url)
@@ -244,6 +369,20 @@ class GoogleSheetsClient:
                 logging.error(f"Falha ao atualizar o relatório de divergências: {e}", exc_info=True)
                 raise
 
+_thread_local = threading.local()
+
+def _gs_client_da_thread() -> GoogleSheetsClient:
+    """Cada thread autentica o seu próprio cliente gspread, que não é compartilhado entre threads."""
+    if getattr(_thread_local, 'gs_client', None) is None:
+        _thread_local.gs_client = GoogleSheetsClient(Config.GOOGLE_SHEETS_CONFIG["credentials_path"])
+    return _thread_local.gs_client
+
+def _commit_all_em_thread(*args):
+    return _gs_client_da_thread().commit_all(*args)
+
+def _update_status_banner_em_thread(*args):
+    return _gs_client_da_thread().update_status_banner(*args)
+
 def carregar_dados_sharepoint(source_config: Dict[str, Any]) -> pd.DataFrame:
     logging.info(f"--- Iniciando coleta da fonte SharePoint: {source_config['name']} ---")
     sp_client = SharePointClient(source_config)
@@ -251,16 +390,25 @@ def carregar_dados_sharepoint(source_config: Dict[str, Any]) -> pd.DataFrame:
     if not all_items:
         return pd.DataFrame()
     list_of_dataframes = []
+    items_para_ler = []
     for item in all_items:
         if "folder" in item:
             continue
         file_name = item['name']
-        if any(keyword in file_name.lower() for keyword in Config.KEYWORDS_TO_EXCLUDE):
+        if Config.KEYWORDS_TO_EXCLUDE_RE.search(file_name):
             continue
-        df = sp_client.read_excel_sheet(item['id'], file_name)
-        if df is not None and not df.empty:
-            df['Fonte do Arquivo'] = file_name
-            list_of_dataframes.append(df)
+        items_para_ler.append(item)
+    
+    # Metadados de todos os arquivos em lotes do $batch; só os downloads (links pré-autenticados) seguem individuais
+    download_urls = sp_client.get_download_urls_batch([item['id'] for item in items_para_ler])
+    
+    # Downloads em paralelo (a espera é de rede); map preserva a ordem dos arquivos
+    with ThreadPoolExecutor(max_workers=Config.MAX_WORKERS) as executor:
+        resultados = executor.map(lambda item: sp_client.read_excel_sheet(item['id'], item['name'], download_urls.get(item['id'])), items_para_ler)
+        for item, df in zip(items_para_ler, resultados):
+            if df is not None and not df.empty:
+                df['Fonte do Arquivo'] = item['name']
+                list_of_dataframes.append(df)
     if not list_of_dataframes:
         return pd.DataFrame()
     consolidated_df = pd.concat(list_of_dataframes, ignore_index=True)
@@ -269,14 +417,16 @@ def carregar_dados_sharepoint(source_config: Dict[str, Any]) -> pd.DataFrame:
 
 def carregar_dados_google_sheets(source_config: Dict[str, Any]) -> pd.DataFrame:
     logging.info(f"--- Iniciando coleta da fonte Google Sheets: {source_config['name']} ---")
-    gs_client = GoogleSheetsClient(source_config["credentials_path"])
     list_of_dataframes = []
     all_sheets_data = pd.DataFrame() # DataFrame para armazenar todos os dados brutos
     
-    for url in source_config["sheet_urls"]:
-        df = gs_client.get_data_as_dataframe(url, source_config["sheet_name_to_read"], source_config["header"])
-        if not df.empty:
-            list_of_dataframes.append(df)
+    # Uma planilha por thread (a espera é de rede); map preserva a ordem das URLs
+    urls = source_config["sheet_urls"]
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        resultados = executor.map(lambda url: _gs_client_da_thread().get_data_as_dataframe(url, source_config["sheet_name_to_read"], source_config["header"]), urls)
+        for df in resultados:
+            if not df.empty:
+                list_of_dataframes.append(df)
 
     if not list_of_dataframes:
         logging.warning("Nenhum dado válido extraído das planilhas Google.")
@@ -286,11 +436,50 @@ def carregar_dados_google_sheets(source_config: Dict[str, Any]) -> pd.DataFrame:
     logging.info(f"Fonte '{source_config['name']}' consolidada. Total de {len(all_sheets_data)} linhas brutas.")
     return all_sheets_data
 
+def _padronizar_fonte(fontes: pd.Series, filename_map: Dict[str, str]) -> pd.Series:
+    """
+    De-para do nome do arquivo para a fonte padronizada, avaliado uma única vez por nome distinto.
+    Entre as chaves contidas no nome vence a que vem por último no FILENAME_MAP, em qualquer posição
+    do nome (mesmo resultado do laço de substituições sucessivas). Sem chave, mantém o nome original.
+    """
+    chaves = [(chave.lower(), valor) for chave, valor in reversed(filename_map.items())]
+    codigos, nomes = pd.factorize(fontes)
+    padronizados = [next((valor for chave, valor in chaves if chave in str(nome).lower()), nome) for nome in nomes]
+    # O código -1 (nulo) indexa o último elemento, que mantém o nulo
+    padronizados = np.array(padronizados + [np.nan], dtype=object)
+    return pd.Series(padronizados[codigos], index=fontes.index)
+
+def _converter_data_sheets(serie: pd.Series) -> pd.Series:
+    """
+    Converte as datas lidas do Google Sheets: números seriais (dias desde 30/12/1899) numa única operação e,
+    para células digitadas como texto, o formato dd/mm/aaaa. O restante vira NaT.
+    """
+    seriais = pd.to_numeric(serie, errors='coerce')
+    datas = pd.to_datetime(seriais, unit='D', origin='1899-12-30')
+    return datas.fillna(pd.to_datetime(serie.where(seriais.isna()), format='%d/%m/%Y', errors='coerce'))
+
 def _normalizar_texto_para_chave(series: Any) -> Any:
     if isinstance(series, pd.Series):
-        return series.astype(str).str.strip().str.lower().str.replace('[^a-z0-9]', '', regex=True)
+        # Uma única passada de regex sobre strings Arrow (o padrão já remove os espaços das pontas)
+        return series.astype(STRING_DTYPE).str.lower().str.replace(_KEY_RE.pattern, '', regex=True).fillna('')
     else:
-        return re.sub('[^a-z0-9]', '', str(series).strip().lower())
+        return _KEY_RE.sub('', str(series).strip().lower())
+
+def _juntar_chave(*partes: pd.Series) -> pd.Series:
+    """Junta partes já normalizadas com '_'. Com pyarrow, é um único kernel Arrow (binary_join_element_wise)."""
+    if pc is None:
+        return partes[0].str.cat(list(partes[1:]), sep='_')
+    chave = pc.binary_join_element_wise(*(pa.array(parte, type=pa.string()) for parte in partes), '_')
+    return pd.Series(pd.arrays.ArrowStringArray(chave), index=partes[0].index)
+
+def _montar_chaves_descargas(colunas_chave: pd.DataFrame) -> pd.DataFrame:
+    """Monta as chaves de Descargas (nota/placa + produto + fonte). Função de módulo para poder rodar num ProcessPoolExecutor."""
+    # Sufixo produto + fonte normalizado uma única vez e compartilhado pelas duas chaves
+    sufixo_chave = '_' + _normalizar_texto_para_chave(colunas_chave['produto']) + '_' + _normalizar_texto_para_chave(colunas_chave['Fonte Padronizada'])
+    return pd.DataFrame({
+        'chave_primaria': _normalizar_texto_para_chave(colunas_chave['nota']) + sufixo_chave,
+        'chave_placa_fonte_produto': _normalizar_texto_para_chave(colunas_chave['placa']) + sufixo_chave,
+    })
 
 def processar_dados_descargas(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
@@ -326,54 +515,113 @@ def processar_dados_descargas(df: pd.DataFrame) -> pd.DataFrame:
     df['produto'] = df['produto'].replace(Config.PRODUCT_CORRECTIONS)
     # =========================================================================
 
-    df = df[df['produto'].astype(str).str.lower().isin(Config.DESCARGAS_CONFIG['products_to_include'])]
+    # 'produto' já está em minúsculas e sem espaços nas pontas (passo acima): filtra direto no conjunto
+    df = df[df['produto'].isin(Config.DESCARGAS_CONFIG['products_to_include'])]
     data_limite = datetime.now() - timedelta(days=20)
-    df['data'] = pd.to_datetime(df['data'], errors='coerce', dayfirst=True)
+    # Formato fixo dd/mm/aaaa: parse vetorizado em C, sem o fallback por linha do dateutil (células de data já chegam como datetime).
+    # exact=False: textos com hora após a data (dd/mm/aaaa hh:mm) também são aceitos
+    df['data'] = pd.to_datetime(df['data'], format='%d/%m/%Y', exact=False, errors='coerce')
     df = df[df['data'].notna() & (df['data'] > data_limite)]
     
     logging.info("Aplicando regra 'de-para' na fonte do arquivo para padronização.")
-    df['Fonte Padronizada'] = df['Fonte do Arquivo']
-    for key, value in Config.FILENAME_MAP.items():
-        mask = df['Fonte do Arquivo'].astype(str).str.contains(key, case=False, na=False)
-        df.loc[mask, 'Fonte Padronizada'] = value
+    df['Fonte Padronizada'] = _padronizar_fonte(df['Fonte do Arquivo'], Config.FILENAME_MAP)
     
+    colunas_chave = df[['nota', 'placa', 'produto', 'Fonte Padronizada']]
+    if len(df) > Config.LIMIAR_CHAVES_EM_PARALELO:
+        # Frames grandes: blocos de linhas normalizados em processos separados (a regex é o custo dominante)
+        num_processos = os.cpu_count() or 1
+        tamanho_bloco = -(-len(df) // num_processos)
+        blocos = [colunas_chave.iloc[inicio:inicio + tamanho_bloco] for inicio in range(0, len(df), tamanho_bloco)]
+        with ProcessPoolExecutor(max_workers=num_processos) as executor:
+            chaves = pd.concat(list(executor.map(_montar_chaves_descargas, blocos)))
+    else:
+        chaves = _montar_chaves_descargas(colunas_chave)
+
     # --- INÍCIO DA MELHORIA 1: Atualização da chave primária de Descargas ---
-    df['chave_primaria'] = (_normalizar_texto_para_chave(df['nota']) + '_' +
-                              _normalizar_texto_para_chave(df['produto']) + '_' +
-                              _normalizar_texto_para_chave(df['Fonte Padronizada']))
+    df['chave_primaria'] = chaves['chave_primaria'].to_numpy()
     # --- FIM DA MELHORIA 1 ---
 
     # Mantendo a chave secundária para a Etapa 2 do cruzamento
-    df['chave_placa_fonte_produto'] = (_normalizar_texto_para_chave(df['placa']) + '_' +
-                                       _normalizar_texto_para_chave(df['produto']) + '_' +
-                                       _normalizar_texto_para_chave(df['Fonte Padronizada']))
+    df['chave_placa_fonte_produto'] = chaves['chave_placa_fonte_produto'].to_numpy()
     return df
 
 def processar_dados_transportes(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         return df
     logging.info("Processando dados de Transportes (Filtros e Chaves)...")
-    cfg = Config.GOOGLE_SHEETS_CONFIG
     df['status'] = df['status'].astype(str)
-    status_validos = [s.lower() for s in cfg['status_para_incluir']]
-    df_filtrado = df[df['status'].str.lower().isin(status_validos)].copy()
+    df_filtrado = df[df['status'].str.lower().isin(Config.STATUS_VALIDOS)].copy()
     
     if df_filtrado.empty:
         return pd.DataFrame()
     
+    # Sufixo produto + recebedor normalizado uma única vez e compartilhado pelas duas chaves
+    sufixo_chave = '_' + _normalizar_texto_para_chave(df_filtrado['produto']) + '_' + _normalizar_texto_para_chave(df_filtrado['recebedor'])
+
     # --- INÍCIO DA MELHORIA 1: Atualização da chave primária de Transportes ---
-    df_filtrado['chave_primaria'] = (_normalizar_texto_para_chave(df_filtrado['nfe']) + '_' +
-                                       _normalizar_texto_para_chave(df_filtrado['produto']) + '_' +
-                                       _normalizar_texto_para_chave(df_filtrado['recebedor']))
+    df_filtrado['chave_primaria'] = _normalizar_texto_para_chave(df_filtrado['nfe']) + sufixo_chave
     # --- FIM DA MELHORIA 1 ---
     
     # Mantendo a chave secundária para a Etapa 2 do cruzamento
-    df_filtrado['chave_placa_recebedor_produto'] = (_normalizar_texto_para_chave(df_filtrado['cavalo']) + '_' +
-                                                    _normalizar_texto_para_chave(df_filtrado['produto']) + '_' +
-                                                    _normalizar_texto_para_chave(df_filtrado['recebedor']))
-    df_filtrado['data_de_carregamento'] = pd.to_datetime(df_filtrado['data_de_carregamento'], errors='coerce', dayfirst=True)
+    df_filtrado['chave_placa_recebedor_produto'] = _normalizar_texto_para_chave(df_filtrado['cavalo']) + sufixo_chave
+    # Datas chegam como serial: convertidas aqui para que a escrita devolva dd/mm/aaaa (e não o número) nas linhas atualizadas
+    for coluna_data in ('data_de_carregamento', 'data_chegada', 'data_descarga'):
+        df_filtrado[coluna_data] = _converter_data_sheets(df_filtrado[coluna_data])
     return df_filtrado
 
+def _como_categorias_comuns(*series: pd.Series) -> List[pd.Series]:
+    """Converte colunas de chave para category com um único conjunto de categorias: o merge passa a comparar códigos inteiros."""
+    tipo_comum = pd.CategoricalDtype(pd.concat(series, ignore_index=True).dropna().unique())
+    return [serie.astype(tipo_comum) for serie in series]
+
+def _buscar_descargas(descargas_unicas: pd.DataFrame, chave_descargas: pd.Series, chave_transportes: pd.Series, colunas: List[str]) -> pd.DataFrame:
+    """
+    Busca indexada: as descargas (chaves únicas) viram um índice e o reindex pelas chaves dos transportes devolve
+    as colunas pedidas alinhadas às linhas de transporte, nulas onde não houve match.
+    """
+    lookup = descargas_unicas[colunas].set_index(pd.Index(chave_descargas))
+    match = lookup.reindex(pd.Index(chave_transportes))
+    match.index = chave_transportes.index
+    return match
+
+def _aplicar_transicoes(transportes: pd.DataFrame, match: pd.DataFrame, tem_match: pd.Series, etapa: str, fonte: str,
+                        contadores: Dict[str, int], indices_usados: Set[int]):
+    """Aplica em bloco (máscaras booleanas) as mudanças de status das linhas que tiveram match na etapa."""
+    indices_usados.update(match.loc[tem_match, 'original_index'].astype(int).tolist())
+    
+    status_original = transportes['status'].astype(str).str.lower()
+    novo_status = pd.Series(np.where(match['data_de_descarga'].isna(), 'aguardando descarga', 'descarregado'), index=transportes.index)
+    mudou = tem_match & (novo_status != status_original)
+    
+    em_transito = status_original.str.contains('trânsito', regex=False)
+    aguardando = status_original.str.contains('aguardando', regex=False)
+    vai_descarregar = novo_status == 'descarregado'
+    
+    transito_para_aguardando = mudou & em_transito & ~vai_descarregar
+    transito_para_descarregado = mudou & em_transito & vai_descarregar
+    aguardando_para_descarregado = mudou & ~em_transito & aguardando & vai_descarregar
+    para_descarregado = transito_para_descarregado | aguardando_para_descarregado
+    
+    # Novos valores montados em arrays numpy e gravados com uma única atribuição por coluna
+    mudou, transito_para_aguardando, para_descarregado = mudou.to_numpy(), transito_para_aguardando.to_numpy(), para_descarregado.to_numpy()
+    data_chegada = transportes['data_chegada'].to_numpy(dtype=object, copy=True)
+    data_chegada[mudou] = match['data'].to_numpy(dtype=object)[mudou]
+    fonte_atualizacao = transportes['fonte_atualizacao'].to_numpy(dtype=object, copy=True)
+    fonte_atualizacao[mudou] = fonte
+    status = transportes['status'].to_numpy(dtype=object, copy=True)
+    status[transito_para_aguardando] = 'AGUARDANDO DESCARGA'
+    status[para_descarregado] = 'DESCARREGADO'
+    data_descarga = transportes['data_descarga'].to_numpy(dtype=object, copy=True)
+    data_descarga[para_descarregado] = match['data_de_descarga'].to_numpy(dtype=object)[para_descarregado]
+    transportes['data_chegada'] = data_chegada
+    transportes['fonte_atualizacao'] = fonte_atualizacao
+    transportes['status'] = status
+    transportes['data_descarga'] = data_descarga
+    
+    contadores[f'{etapa}_transito_para_aguardando'] += int(transito_para_aguardando.sum())
+    contadores[f'{etapa}_transito_para_descarregado'] += int(transito_para_descarregado.sum())
+    contadores[f'{etapa}_aguardando_para_descarregado'] += int(aguardando_para_descarregado.sum())
+
 def cruzar_e_atualizar_transportes(df_transportes: pd.DataFrame, df_descargas: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[str, int], Set[int]]:
     if not isinstance(df_transportes, pd.DataFrame):
         df_transportes = pd.DataFrame()
@@ -389,62 +637,28 @@ def cruzar_e_atualizar_transportes(df_transportes: pd.DataFrame, df_descargas: p
     
     descargas_com_indice = df_descargas.copy()
     descargas_com_indice['original_index'] = descargas_com_indice.index
+    colunas_match = ['data', 'data_de_descarga', 'original_index']
     
     # --- INÍCIO DA MELHORIA 1: Usando a nova chave primária para o cruzamento ---
     descargas_unicas = descargas_com_indice.drop_duplicates(subset=['chave_primaria'], keep='last')
-    mapa_chaves = descargas_unicas.set_index('chave_primaria').to_dict('index')
-
-    for index, transporte in transportes_atualizado.iterrows():
-        match = mapa_chaves.get(transporte['chave_primaria'])
+    chave_transportes, chave_descargas = _como_categorias_comuns(transportes_atualizado['chave_primaria'], descargas_unicas['chave_primaria'])
+    match_primaria = _buscar_descargas(descargas_unicas, chave_descargas, chave_transportes, colunas_match)
     # --- FIM DA MELHORIA 1 ---
-        if match:
-            indices_descargas_usados.add(match['original_index'])
-            
-            status_original = str(transporte['status']).lower()
-            novo_status = 'aguardando descarga' if pd.isna(match.get('data_de_descarga')) else 'descarregado'
-            
-            if novo_status != status_original:
-                transportes_atualizado.loc[index, 'data_chegada'] = match['data']
-                transportes_atualizado.loc[index, 'fonte_atualizacao'] = 'Etapa 1 - Chave Primária'
-                if 'trânsito' in status_original and novo_status == 'aguardando descarga':
-                    transportes_atualizado.loc[index, 'status'] = 'AGUARDANDO DESCARGA'
-                    contadores['etapa1_transito_para_aguardando'] += 1
-                elif 'trânsito' in status_original and novo_status == 'descarregado':
-                    transportes_atualizado.loc[index, 'status'] = 'DESCARREGADO'
-                    transportes_atualizado.loc[index, 'data_descarga'] = match['data_de_descarga']
-                    contadores['etapa1_transito_para_descarregado'] += 1
-                elif 'aguardando' in status_original and novo_status == 'descarregado':
-                    transportes_atualizado.loc[index, 'status'] = 'DESCARREGADO'
-                    transportes_atualizado.loc[index, 'data_descarga'] = match['data_de_descarga']
-                    contadores['etapa1_aguardando_para_descarregado'] += 1
+    tem_match = match_primaria['original_index'].notna()
+    _aplicar_transicoes(transportes_atualizado, match_primaria, tem_match, 'etapa1', 'Etapa 1 - Chave Primária', contadores, indices_descargas_usados)
 
     descargas_unicas_placa = descargas_com_indice.drop_duplicates(subset=['chave_placa_fonte_produto'], keep='last')
-    mapa_placa = descargas_unicas_placa.set_index('chave_placa_fonte_produto').to_dict('index')
-    
-    transportes_para_etapa_2 = transportes_atualizado[transportes_atualizado['fonte_atualizacao'] == 'Não Atualizado']
-    for index, transporte in transportes_para_etapa_2.iterrows():
-        chave_busca_placa = _normalizar_texto_para_chave(transporte['cavalo']) + '_' + _normalizar_texto_para_chave(transporte['produto']) + '_' + _normalizar_texto_para_chave(transporte['recebedor'])
-        match = mapa_placa.get(chave_busca_placa)
-        if match:
-            if pd.notna(transporte['data_de_carregamento']) and pd.to_datetime(match['data']) >= transporte['data_de_carregamento']:
-                indices_descargas_usados.add(match['original_index'])
-                
-                status_original = str(transporte['status']).lower()
-                novo_status = 'aguardando descarga' if pd.isna(match.get('data_de_descarga')) else 'descarregado'
-                if novo_status != status_original:
-                    transportes_atualizado.loc[index, 'data_chegada'] = match['data']
-                    transportes_atualizado.loc[index, 'fonte_atualizacao'] = 'Etapa 2 - Placa'
-                    if 'trânsito' in status_original and novo_status == 'aguardando descarga':
-                        transportes_atualizado.loc[index, 'status'] = 'AGUARDANDO DESCARGA'
-                        contadores['etapa2_transito_para_aguardando'] += 1
-                    elif 'trânsito' in status_original and novo_status == 'descarregado':
-                        transportes_atualizado.loc[index, 'status'] = 'DESCARREGADO'
-                        transportes_atualizado.loc[index, 'data_descarga'] = match['data_de_descarga']
-                        contadores['etapa2_transito_para_descarregado'] += 1
-                    elif 'aguardando' in status_original and novo_status == 'descarregado':
-                        transportes_atualizado.loc[index, 'status'] = 'DESCARREGADO'
-                        transportes_atualizado.loc[index, 'data_descarga'] = match['data_de_descarga']
-                        contadores['etapa2_aguardando_para_descarregado'] += 1
+    # A chave placa + produto + recebedor do transporte é a mesma já montada em processar_dados_transportes
+    chave_transportes, chave_descargas = _como_categorias_comuns(transportes_atualizado['chave_placa_recebedor_produto'], descargas_unicas_placa['chave_placa_fonte_produto'])
+    match_placa = _buscar_descargas(descargas_unicas_placa, chave_descargas, chave_transportes, colunas_match)
+    data_carregamento = transportes_atualizado['data_de_carregamento']
+    tem_match = (
+        (transportes_atualizado['fonte_atualizacao'] == 'Não Atualizado') &
+        match_placa['original_index'].notna() &
+        data_carregamento.notna() &
+        (match_placa['data'] >= data_carregamento)
+    )
+    _aplicar_transicoes(transportes_atualizado, match_placa, tem_match, 'etapa2', 'Etapa 2 - Placa', contadores, indices_descargas_usados)
     
     return transportes_atualizado, contadores, indices_descargas_usados
     
@@ -453,6 +667,9 @@ def main():
         logging.info("--- INICIANDO PROCESSO COMPLETO DE COLETA E ATUALIZAÇÃO ---")
         Config.validate()
         
+        # Cliente da thread principal (relatório); as leituras e atualizações paralelas usam um cliente por thread
+        gs_client = _gs_client_da_thread()
+        
         raw_descargas = carregar_dados_sharepoint(Config.DESCARGAS_CONFIG)
         raw_transportes = carregar_dados_google_sheets(Config.GOOGLE_SHEETS_CONFIG)
         
@@ -463,8 +680,6 @@ def main():
         
         df_updates = df_transportes_final[df_transportes_final['fonte_atualizacao'] != 'Não Atualizado']
         
-        gs_client = GoogleSheetsClient(Config.GOOGLE_SHEETS_CONFIG["credentials_path"])
-        
         # =========================================================================
         # INÍCIO DA SEÇÃO DE ATUALIZAÇÃO (LÓGICA CORRIGIDA)
         # =========================================================================
@@ -472,50 +687,51 @@ def main():
         processo_bem_sucedido = False
         urls_com_updates = set() # Usamos um set para consulta rápida
 
-        if not df_updates.empty:
-            urls_com_updates = set(df_updates['__gs_url'].unique())
-            try:
-                logging.info(f"Sinalizando {len(urls_com_updates)} planilha(s) Google como 'em atualização'...")
-                for url in urls_com_updates:
-                    gs_client.update_status_banner(url, Config.GOOGLE_SHEETS_CONFIG["sheet_name_to_read"], "Atualizando...", "RED")
-                
-                time.sleep(1)
+        with ThreadPoolExecutor(max_workers=len(Config.GOOGLE_SHEETS_CONFIG["sheet_urls"])) as executor:
+            # Cada planilha é independente: as chamadas por URL rodam em paralelo (list() propaga exceções das threads)
+            sheet_name = Config.GOOGLE_SHEETS_CONFIG["sheet_name_to_read"]
+            timestamp = datetime.now().strftime('%d/%m/%Y às %H:%M:%S')
+
+            if not df_updates.empty:
+                urls_com_updates = set(df_updates['__gs_url'].unique())
+                updates_por_url = dict(tuple(df_updates.groupby('__gs_url', sort=False)))
                 
+                # Calcula os totais de alteração de cada planilha modificada para o painel final
+                mensagens_sucesso = {}
+                for url, updates_nesta_planilha in updates_por_url.items():
+                    total_t_ad = (updates_nesta_planilha['status'] == 'AGUARDANDO DESCARGA').sum()
+                    total_desc = (updates_nesta_planilha['status'] == 'DESCARREGADO').sum()
+                    mensagens_sucesso[url] = f"Atualizado em {timestamp}. Status alterados: {total_t_ad} (Trânsito -> Aguardando), {total_desc} (-> Descarregado)"
+
+                # Dados e painel final vão juntos num único batchUpdate por planilha, que é atômico:
+                # o aviso prévio 'Atualizando...' deixou de ser necessário e só as planilhas que falharam são pintadas
                 logging.info(f"Iniciando atualização de {len(df_updates)} registros no Google Sheets...")
-                for url in urls_com_updates:
-                    updates_neste_arquivo = df_updates[df_updates['__gs_url'] == url]
-                    gs_client.batch_update_data(url, Config.GOOGLE_SHEETS_CONFIG["sheet_name_to_read"], updates_neste_arquivo, Config.GOOGLE_SHEETS_CONFIG["header"])
-                
+                futuros = {url: executor.submit(_commit_all_em_thread, url, sheet_name, mensagens_sucesso[url], "GREEN", updates_por_url[url], Config.GOOGLE_SHEETS_CONFIG["header"])
+                           for url in urls_com_updates}
+                falhas = {}
+                for url, futuro in futuros.items():
+                    try:
+                        futuro.result()
+                    except Exception as e:
+                        logging.critical(f"❌ ERRO DURANTE ATUALIZAÇÃO NO GOOGLE SHEETS ({url}): {e}", exc_info=True)
+                        falhas[url] = e
+
+                if falhas:
+                    # Planilhas cujo commit_all já deu certo mantêm o painel verde
+                    list(executor.map(lambda url: _update_status_banner_em_thread(url, sheet_name, f"Falha na atualização. Detalhe: {str(falhas[url])[:150]}", "YELLOW"), falhas))
+                    raise RuntimeError(f"Falha ao atualizar {len(falhas)} de {len(futuros)} planilha(s) no Google Sheets.") from next(iter(falhas.values()))
+
                 logging.info("✅ SUCESSO! Atualizações de dados no Google Sheets concluídas.")
                 processo_bem_sucedido = True
-            except Exception as e:
-                logging.critical(f"❌ ERRO DURANTE ATUALIZAÇÃO NO GOOGLE SHEETS: {e}", exc_info=True)
-                for url in urls_com_updates:
-                    gs_client.update_status_banner(url, Config.GOOGLE_SHEETS_CONFIG["sheet_name_to_read"], f"Falha na atualização. Detalhe: {str(e)[:150]}", "YELLOW")
-                raise
-        else:
-            logging.info("Nenhuma atualização de status necessária.")
-            processo_bem_sucedido = True # Se não há updates, o processo foi 'bem-sucedido'
-
-        # Lógica final para atualizar TODOS os banners, tratando cada caso
-        if processo_bem_sucedido:
-            timestamp = datetime.now().strftime('%d/%m/%Y às %H:%M:%S')
-            # Percorre TODAS as planilhas configuradas
-            for url in Config.GOOGLE_SHEETS_CONFIG["sheet_urls"]:
-                # Verifica se a planilha atual ESTÁ na lista daquelas que foram modificadas
-                if url in urls_com_updates:
-                    # Calcula os totais de alteração APENAS para esta planilha
-                    updates_nesta_planilha = df_updates[df_updates['__gs_url'] == url]
-                    
-                    total_t_ad = (updates_nesta_planilha['status'] == 'AGUARDANDO DESCARGA').sum()
-                    total_desc = (updates_nesta_planilha['status'] == 'DESCARREGADO').sum()
+            else:
+                logging.info("Nenhuma atualização de status necessária.")
+                processo_bem_sucedido = True # Se não há updates, o processo foi 'bem-sucedido'
 
-                    msg_sucesso = f"Atualizado em {timestamp}. Status alterados: {total_t_ad} (Trânsito -> Aguardando), {total_desc} (-> Descarregado)"
-                    gs_client.update_status_banner(url, Config.GOOGLE_SHEETS_CONFIG["sheet_name_to_read"], msg_sucesso, "GREEN")
-                else:
-                    # Se a planilha não foi modificada, envia a mensagem de "sem alterações"
-                    msg_sem_alteracao = f"Atualizado em {timestamp}. Nenhuma alteração de status nesta execução."
-                    gs_client.update_status_banner(url, Config.GOOGLE_SHEETS_CONFIG["sheet_name_to_read"], msg_sem_alteracao, "GREEN")
+            # Planilhas sem alterações nesta execução recebem só o painel de "sem alterações"
+            if processo_bem_sucedido:
+                msg_sem_alteracao = f"Atualizado em {timestamp}. Nenhuma alteração de status nesta execução."
+                urls_sem_updates = [url for url in Config.GOOGLE_SHEETS_CONFIG["sheet_urls"] if url not in urls_com_updates]
+                list(executor.map(lambda url: _update_status_banner_em_thread(url, sheet_name, msg_sem_alteracao, "GREEN"), urls_sem_updates))
 
         # =========================================================================
         # FIM DA SEÇÃO DE ATUALIZAÇÃO (LÓGICA CORRIGIDA)
@@ -526,47 +742,50 @@ def main():
         # =========================================================================
         logging.info("Iniciando a geração do relatório de divergências...")
         if not df_descargas.empty:
-            df_descargas_nao_usadas = df_descargas.drop(index=list(indices_usados))
+            # Máscara pela hashtable de inteiros do índice, sem montar lista a partir do set
+            nao_usadas = ~df_descargas.index.isin(np.fromiter(indices_usados, dtype=np.int64, count=len(indices_usados)))
+            df_descargas_nao_usadas = df_descargas[nao_usadas]
             
             # PASSO 1: Criar a "lista de exceções" com base nos transportes já descarregados hoje
-            hoje_str = datetime.now().strftime('%Y-%m-%d')
-            raw_transportes['data_descarga'] = pd.to_datetime(raw_transportes['data_descarga'], errors='coerce', dayfirst=True)
+            # Data de hoje calculada uma vez; as colunas são comparadas como datetime (normalize zera a hora)
+            hoje = pd.Timestamp(datetime.now().date())
+            raw_transportes['data_descarga'] = _converter_data_sheets(raw_transportes['data_descarga'])
 
             df_descarregados_hoje = raw_transportes[
                 (raw_transportes['status'].str.lower() == 'descarregado') &
-                (raw_transportes['data_descarga'].dt.strftime('%Y-%m-%d') == hoje_str)
+                raw_transportes['data_descarga'].dt.normalize().eq(hoje)
             ].copy()
 
-            chaves_excecao_primaria = set()
-            chaves_excecao_placa = set()
+            # Exceções guardadas como pd.Index de chaves únicas: o isin usa direto a hashtable do pandas
+            chaves_excecao_primaria = pd.Index([], dtype=object)
+            chaves_excecao_placa = pd.Index([], dtype=object)
 
             if not df_descarregados_hoje.empty:
+                # Cada coluna é normalizada uma única vez (kernels Arrow) e as chaves saem de um join element-wise
+                norm = {col: _normalizar_texto_para_chave(df_descarregados_hoje[col]) for col in ('nfe', 'produto', 'recebedor', 'cavalo')}
                 # --- INÍCIO DA MELHORIA 1: Usa a nova chave primária para a lista de exceções ---
-                df_descarregados_hoje['chave_primaria'] = (_normalizar_texto_para_chave(df_descarregados_hoje['nfe']) + '_' +
-                                                            _normalizar_texto_para_chave(df_descarregados_hoje['produto']) + '_' +
-                                                            _normalizar_texto_para_chave(df_descarregados_hoje['recebedor']))
-                chaves_excecao_primaria = set(df_descarregados_hoje['chave_primaria'])
+                df_descarregados_hoje['chave_primaria'] = _juntar_chave(norm['nfe'], norm['produto'], norm['recebedor'])
+                chaves_excecao_primaria = pd.Index(df_descarregados_hoje['chave_primaria'].unique())
                 # --- FIM DA MELHORIA 1 ---
                 
                 # Cria a chave de exceção por PLACA (secundária)
-                df_descarregados_hoje['chave_placa_recebedor_produto'] = (_normalizar_texto_para_chave(df_descarregados_hoje['cavalo']) + '_' +
-                                                                            _normalizar_texto_para_chave(df_descarregados_hoje['produto']) + '_' +
-                                                                            _normalizar_texto_para_chave(df_descarregados_hoje['recebedor']))
-                chaves_excecao_placa = set(df_descarregados_hoje['chave_placa_recebedor_produto'])
+                df_descarregados_hoje['chave_placa_recebedor_produto'] = _juntar_chave(norm['cavalo'], norm['produto'], norm['recebedor'])
+                chaves_excecao_placa = pd.Index(df_descarregados_hoje['chave_placa_recebedor_produto'].unique())
                 
                 logging.info(f"Encontradas {len(chaves_excecao_primaria)} chaves de exceção primárias e {len(chaves_excecao_placa)} por placa para evitar falsos positivos.")
             else:
                 logging.info("Nenhuma viagem previamente descarregada hoje. Nenhuma exceção será aplicada.")
 
             # PASSO 2: Filtragem das divergências, aplicando a exceção
-            df_descargas_nao_usadas['data_de_descarga'] = pd.to_datetime(df_descargas_nao_usadas['data_de_descarga'], errors='coerce', dayfirst=True)
-            hoje = datetime.now().date()
+            # Datas convertidas à parte e gravadas só no recorte final (o recorte das não usadas não é escrito)
+            # exact=False: textos com hora após a data (dd/mm/aaaa hh:mm) também passam pelo parser em C
+            data_de_descarga = pd.to_datetime(df_descargas_nao_usadas['data_de_descarga'], format='%d/%m/%Y', exact=False, errors='coerce')
             
-            filtro_data = (df_descargas_nao_usadas['data_de_descarga'].isna()) | (df_descargas_nao_usadas['data_de_descarga'].dt.date == hoje)
-            df_relatorio = df_descargas_nao_usadas[filtro_data].copy()
+            filtro_data = (data_de_descarga.isna()) | data_de_descarga.dt.normalize().eq(hoje)
+            df_relatorio = df_descargas_nao_usadas[filtro_data].assign(data_de_descarga=data_de_descarga[filtro_data])
 
             # --- INÍCIO DA MELHORIA 1: Aplica o filtro de exceção usando a nova chave primária ---
-            if not df_relatorio.empty and (chaves_excecao_primaria or chaves_excecao_placa):
+            if not df_relatorio.empty and (len(chaves_excecao_primaria) > 0 or len(chaves_excecao_placa) > 0):
                 logging.info("Aplicando filtro de exceção duplo (chave primária e placa) para remover falsos positivos...")
                 
                 # Compara a chave primária do relatório com a lista de exceção
@@ -582,8 +801,8 @@ def main():
             # PASSO 3: Filtro final de produto e escrita do relatório
             df_relatorio_final = pd.DataFrame()
             if not df_relatorio.empty:
-                filtro_produto = (df_relatorio['produto'].str.contains('gasolina', case=False, na=False)) | \
-                                 (df_relatorio['produto'].str.contains('diesel ', case=False, na=False))
+                # Uma única passada de regex com as duas alternativas
+                filtro_produto = df_relatorio['produto'].str.contains('gasolina|diesel ', case=False, regex=True, na=False)
                 df_relatorio_final = df_relatorio[filtro_produto]
 
             if not df_relatorio_final.empty:
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import io
+import re
 import os
+import tempfile
+import time
 import logging
 import pandas as pd
 import numpy as np
+import openpyxl
+import pyarrow as pa
 import requests
 from dotenv import load_dotenv
 from typing import List, Dict, Any
@@ -49,8 +54,11 @@ class Config:
     
     SHAREPOINT_DEST_FILE: str = "Painel_Tanques_Consolidado.xlsx" 
     SHAREPOINT_DEST_SHEET: str = "Base_Consolidada"
+    # Histórico consolidado em Parquet (colunar + zstd); o XLSX fica só com a aba "Atual"
+    SHAREPOINT_HIST_FILE: str = "Painel_Tanques_Historico.parquet"
 
     KEYWORDS_TO_EXCLUDE: List[str] = ["backup", "modelo", "corrompida", "corrompido", "dinamica"]
+    KEYWORDS_TO_EXCLUDE_RE: re.Pattern = re.compile('|'.join(re.escape(keyword) for keyword in KEYWORDS_TO_EXCLUDE), re.IGNORECASE)
 
     FILENAME_MAP: Dict[str, str] = {
         "ARUJA": "Aruja", "BARRA_MANSA": "Barra Mansa", "BCAG": "BCAG",
@@ -62,7 +70,12 @@ class Config:
         "TRR_AB": "Americo", "TRR_CATANDUVA": "Catanduva", "VAISHIA": "Vaishia"
     }
     
-    PRODUTOS_EXCLUIDOS: List[str] = ["GAS C", "B100", "AS10", "AS500","GAS, C"]
+    # Já em maiúsculas: a comparação é feita contra PRODUTO normalizado com strip().upper()
+    PRODUTOS_EXCLUIDOS: frozenset = frozenset(p.upper() for p in ["GAS C", "B100", "AS10", "AS500","GAS, C"])
+    EMPRESAS_INVALIDAS: frozenset = frozenset(['-', '', 'nan'])
+
+    # --- ESCRITA EM BLOCOS NO EXCEL ONLINE ---
+    WRITE_CHUNK_ROWS: int = 10_000
 
     @staticmethod
     def validate():
@@ -76,17 +89,26 @@ class Config:
 
 class SharePointClient:
     """Classe para interagir com a API do Microsoft Graph para o SharePoint."""
+    # Compartilhados entre as instâncias (leitura e escrita): mesma conexão TLS e mesmo token do tenant
+    _session: requests.Session | None = None
+    _token_cache: Dict[str, Any] = {}
+
     def __init__(self, site_config: Dict[str, Any], config: Config):
         self.site_config = site_config
         self.config = config
+        if SharePointClient._session is None:
+            SharePointClient._session = requests.Session()
+        self.session = SharePointClient._session
         self.access_token = self._get_access_token()
         self.site_id = self._get_site_id()
         self.drive_id = self._get_drive_id()
 
-    def _api_request(self, method: str, url: str, json: Dict = None, data=None) -> Dict[str, Any]:
+    def _api_request(self, method: str, url: str, json: Dict = None, data=None, extra_headers: Dict[str, str] = None) -> Dict[str, Any]:
         headers = {"Authorization": f"Bearer {self.access_token}"}
+        if extra_headers:
+            headers.update(extra_headers)
         try:
-            response = requests.request(method, url, headers=headers, json=json, data=data)
+            response = self.session.request(method, url, headers=headers, json=json, data=data)
             response.raise_for_status()
             is_json_response = 'application/json' in response.headers.get('Content-Type', '')
             if response.content and is_json_response:
@@ -97,14 +119,21 @@ class SharePointClient:
             raise
 
     def _get_access_token(self) -> str:
+        cache = SharePointClient._token_cache
+        # Reaproveita o token enquanto faltar mais de 1 minuto para expirar
+        if cache.get('token') and time.time() < cache['expira_em'] - 60:
+            return cache['token']
         url = f"https://login.microsoftonline.com/{self.config.TENANT_ID}/oauth2/v2.0/token"
         data = {
             "client_id": self.config.CLIENT_ID, "scope": "https://graph.microsoft.com/.default",
             "client_secret": self.config.CLIENT_SECRET, "grant_type": "client_credentials"
         }
-        response = requests.post(url, data=data)
+        response = self.session.post(url, data=data)
         response.raise_for_status()
-        return response.json()["access_token"]
+        token_data = response.json()
+        cache['token'] = token_data["access_token"]
+        cache['expira_em'] = time.time() + int(token_data.get("expires_in", 3600))
+        return cache['token']
 
     def _get_site_id(self) -> str:
         url = f"https://graph.microsoft.com/v1.0/sites/{self.config.HOSTNAME}:{self.site_config['site_path']}"
@@ -123,58 +152,132 @@ class SharePointClient:
         url = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}{path_segment}/children"
         return self._api_request('get', url).get("value", [])
 
+    def _baixar_para_buffer(self, download_url: str) -> tempfile.SpooledTemporaryFile:
+        """Baixa o arquivo em streaming; só vai para disco se passar de 64 MB."""
+        buffer = tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024)
+        with self.session.get(download_url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                buffer.write(chunk)
+        buffer.seek(0)
+        return buffer
+
     def read_excel_sheet(self, file_id: str, file_name: str) -> pd.DataFrame | None:
         try:
             url_item = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}"
             download_url = self._api_request('get', url_item).get('@microsoft.graph.downloadUrl')
             if not download_url: return None
             
-            response_content = requests.get(download_url, timeout=60)
-            xls = pd.ExcelFile(io.BytesIO(response_content.content))
-            sheet_name_to_find = self.site_config['sheet_name'].lower()
-            actual_sheet_name = next((s for s in xls.sheet_names if s.lower() == sheet_name_to_find), None)
-            
-            if actual_sheet_name:
-                df_full = pd.read_excel(xls, sheet_name=actual_sheet_name, header=None)
-                start_row_index = -1
-                search_text = "controle de tanque"
-                for index, row in df_full.iterrows():
-                    if any(search_text in str(cell).lower() for cell in row if pd.notna(cell)):
-                        start_row_index = index
-                        break
+            with self._baixar_para_buffer(download_url) as buffer:
+                # Passada read-only do openpyxl só para localizar as linhas dos marcadores (sem materializar a aba)
+                wb = openpyxl.load_workbook(buffer, read_only=True, data_only=True)
+                try:
+                    sheet_name_to_find = self.site_config['sheet_name'].lower()
+                    actual_sheet_name = next((s for s in wb.sheetnames if s.lower() == sheet_name_to_find), None)
+                    if not actual_sheet_name: return None
+
+                    ws = wb[actual_sheet_name]
+                    # Mesmo tratamento que o pd.read_excel aplica: ignora um <dimension> ausente ou errado
+                    ws.reset_dimensions()
+                    start_row_index, stop_row_index = -1, -1
+                    for index, row in enumerate(ws.iter_rows(values_only=True)):
+                        if start_row_index == -1:
+                            if any("controle de tanque" in str(cell).lower() for cell in row if cell is not None):
+                                start_row_index = index
+                        elif index > start_row_index + 1 and any('disponivel para' in str(cell).lower() or 'pedidos em tela' in str(cell).lower()
+                                                                 for cell in row if cell is not None):
+                            stop_row_index = index
+                            break
+                finally:
+                    wb.close()
                 if start_row_index == -1: return None
-                df_data = df_full.iloc[start_row_index + 1:].copy()
+
+                # Leitura só do bloco (cabeçalho + dados até o rodapé) pelo pandas, que normaliza erros/NA e a largura das linhas
+                buffer.seek(0)
+                nrows = stop_row_index - start_row_index - 1 if stop_row_index != -1 else None
+                df_data = pd.read_excel(buffer, sheet_name=actual_sheet_name, header=None, skiprows=start_row_index + 1,
+                                        nrows=nrows, engine='openpyxl')
+                if df_data.empty: return None
                 new_header = df_data.iloc[0]
                 df_data = df_data[1:]
                 df_data.columns = new_header
                 df_data.reset_index(drop=True, inplace=True)
-                stop_row_index = next((index for index, row in df_data.iterrows() if any('disponivel para' in str(cell).lower() or 'pedidos em tela' in str(cell).lower() for cell in row)), -1)
-                df_final = df_data.iloc[:stop_row_index] if stop_row_index != -1 else df_data
-                return df_final.dropna(axis=1, how='all')
-            return None
+                return df_data.dropna(axis=1, how='all')
         except Exception as e:
             logging.error(f"Falha ao ler o arquivo {file_name}. Erro: {e}")
             return None
 
     def read_sharepoint_history(self, file_path: str, sheet_name: str) -> pd.DataFrame:
-        """Lê o histórico existente no arquivo de destino do SharePoint."""
+        """
+        Lê o histórico existente no arquivo de destino do SharePoint (migração para o Parquet).
+        Arquivo (404) ou aba inexistente retornam vazio; outras falhas são repassadas, para não migrar um histórico incompleto.
+        """
         logging.info(f"Buscando histórico existente em: {file_path}")
         try:
             item = self.get_item_by_path(file_path)
-            download_url = item.get('@microsoft.graph.downloadUrl')
-            if not download_url: return pd.DataFrame()
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                logging.warning(f"Histórico não encontrado: {file_path}")
+                return pd.DataFrame()
+            raise
+        download_url = item.get('@microsoft.graph.downloadUrl')
+        if not download_url:
+            raise RuntimeError(f"downloadUrl ausente para o histórico {file_path}.")
 
-            response = requests.get(download_url, timeout=60)
-            xls = pd.ExcelFile(io.BytesIO(response.content))
-            
+        with self._baixar_para_buffer(download_url) as buffer:
+            xls = pd.ExcelFile(buffer, engine='openpyxl')
+        
             if sheet_name in xls.sheet_names:
                 df = pd.read_excel(xls, sheet_name=sheet_name)
                 df.columns = [str(c).upper().strip() for c in df.columns]
                 return df
             return pd.DataFrame()
+
+    def read_parquet_history(self, file_path: str) -> pd.DataFrame | None:
+        """
+        Lê o histórico consolidado salvo em Parquet no SharePoint. Retorna None só quando o arquivo não existe (404);
+        qualquer outra falha é repassada, para que o histórico nunca seja regravado a partir de uma leitura incompleta.
+        """
+        logging.info(f"Buscando histórico Parquet em: {file_path}")
+        try:
+            item = self.get_item_by_path(file_path)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                logging.warning(f"Histórico Parquet ainda não existe: {file_path}")
+                return None
+            raise
+        download_url = item.get('@microsoft.graph.downloadUrl')
+        if not download_url:
+            raise RuntimeError(f"downloadUrl ausente para o histórico {file_path}.")
+
+        with self._baixar_para_buffer(download_url) as buffer:
+            return pd.read_parquet(buffer, engine='pyarrow')
+
+    def upload_dataframe_as_parquet(self, file_path: str, df: pd.DataFrame):
+        """Grava o DataFrame como Parquet num único PUT (upload simples do Graph)."""
+        logging.info(f"--- Gravando histórico Parquet no SharePoint: {file_path} ---")
+        try:
+            df_parquet = _colunas_object_como_string(df)
+            buffer = io.BytesIO()
+            df_parquet.to_parquet(buffer, engine='pyarrow', compression='zstd', index=False)
+
+            folder_prefix = f"/{self.site_config['folder_path']}" if self.site_config.get('folder_path') else ""
+            url_upload = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/root:{folder_prefix}/{file_path}:/content"
+            self._api_request('put', url_upload, data=buffer.getvalue())
+            logging.info(f"✅ Histórico gravado com sucesso ({len(df)} linhas).")
         except Exception as e:
-            logging.warning(f"Histórico não encontrado ou inacessível: {e}")
-            return pd.DataFrame()
+            logging.error(f"❌ Erro ao gravar histórico Parquet: {e}")
+            raise
+
+    def delete_worksheet(self, file_path: str, sheet_name: str):
+        """Remove uma aba do workbook (ausente ou não removida só gera aviso)."""
+        try:
+            file_id = self.get_item_by_path(file_path)['id']
+            url_sheet = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets/{sheet_name}"
+            self._api_request('delete', url_sheet)
+            logging.info(f"🗑️ Aba '{sheet_name}' removida de {file_path}.")
+        except Exception as e:
+            logging.warning(f"Não foi possível remover a aba '{sheet_name}' de {file_path}: {e}")
 
     def get_item_by_path(self, item_path: str) -> Dict:
         folder_prefix = f"/{self.site_config['folder_path']}" if self.site_config.get('folder_path') else ""
@@ -189,21 +292,37 @@ class SharePointClient:
             n = n // 26 - 1
         return result
 
+    def create_workbook_session(self, file_id: str) -> str:
+        """Abre uma sessão persistente no workbook: as escritas são aplicadas em sequência na mesma sessão."""
+        url = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/createSession"
+        return self._api_request('post', url, json={'persistChanges': True})['id']
+
+    def close_workbook_session(self, file_id: str, session_id: str):
+        try:
+            url = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/closeSession"
+            self._api_request('post', url, extra_headers={'workbook-session-id': session_id})
+        except Exception as e:
+            logging.warning(f"Não foi possível fechar a sessão do workbook {file_id}: {e}")
+
     def overwrite_sheet_with_dataframe(self, file_path: str, sheet_name: str, df: pd.DataFrame):
+        """Substitui o conteúdo da aba pelo DataFrame. Falhas são registradas e repassadas ao chamador."""
         logging.info(f"--- Gravando no SharePoint: {file_path} (Aba: {sheet_name}) ---")
+        session_id = None
         try:
             item = self.get_item_by_path(file_path)
             file_id = item['id']
+            session_id = self.create_workbook_session(file_id)
+            sessao = {'workbook-session-id': session_id}
             
             url_sheets = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets"
-            existing_sheets = self._api_request('get', url_sheets).get('value', [])
+            existing_sheets = self._api_request('get', url_sheets, extra_headers=sessao).get('value', [])
             target_sheet_exists = any(s['name'].lower() == sheet_name.lower() for s in existing_sheets)
             
             if not target_sheet_exists:
-                self._api_request('post', url_sheets, json={'name': sheet_name})
+                self._api_request('post', url_sheets, json={'name': sheet_name}, extra_headers=sessao)
             else:
                 url_clear = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets/{sheet_name}/range/clear"
-                self._api_request('post', url_clear, json={'applyTo': 'contents'})
+                self._api_request('post', url_clear, json={'applyTo': 'contents'}, extra_headers=sessao)
 
             if df.empty: return
 
@@ -211,30 +330,71 @@ class SharePointClient:
             df_clean.columns = [str(c) if pd.notna(c) else "" for c in df_clean.columns]
             header_list = list(df_clean.columns)
             
-            # Limpeza de valores para o formato Excel Online
-            values = [header_list]
-            for row in df_clean.values.tolist():
-                clean_row = []
-                for cell in row:
-                    val = str(cell) if pd.notna(cell) else ""
-                    val = val.replace('.0', '') if val.endswith('.0') else val
-                    clean_row.append(val)
-                values.append(clean_row)
-
-            num_rows, num_cols = len(values), len(values[0])
-            end_col_letter = self._convert_to_excel_col(num_cols - 1)
-            address = f"A1:{end_col_letter}{num_rows}"
-
-            url_write = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets/{sheet_name}/range(address='{address}')"
-            self._api_request('patch', url_write, json={'values': values})
+            # Limpeza de valores para o formato Excel Online (vetorizada sobre a matriz inteira)
+            texto = df_clean.astype(object).astype(str).to_numpy(dtype=str)
+            texto = np.where(np.char.endswith(texto, '.0'), np.char.replace(texto, '.0', ''), texto)
+            texto = np.where(df_clean.notna().to_numpy(), texto, "")
+            values = [header_list] + texto.tolist()
+
+            end_col_letter = self._convert_to_excel_col(len(header_list) - 1)
+            url_sheet = f"https://graph.microsoft.com/v1.0/drives/{self.drive_id}/items/{file_id}/workbook/worksheets/{sheet_name}"
+            chunk_rows = self.config.WRITE_CHUNK_ROWS
+
+            # Blocos de linhas (cada PATCH abaixo do limite de payload do Graph), um após o outro:
+            # o Excel Online não aceita escritas concorrentes no mesmo workbook
+            for start in range(0, len(values), chunk_rows):
+                linhas = values[start:start + chunk_rows]
+                address = f"A{start + 1}:{end_col_letter}{start + len(linhas)}"
+                self._api_request('patch', f"{url_sheet}/range(address='{address}')", json={'values': linhas}, extra_headers=sessao)
             logging.info(f"✅ Gravado com sucesso.")
         except Exception as e:
             logging.error(f"❌ Erro ao gravar SharePoint: {e}")
+            raise
+        finally:
+            if session_id:
+                self.close_workbook_session(file_id, session_id)
 
 # ==============================================================================
 # 4. FUNÇÕES DE PROCESSAMENTO
 # ==============================================================================
 
+def _colunas_object_como_string(df: pd.DataFrame) -> pd.DataFrame:
+    """Colunas object podem misturar números e texto (vindas do Excel); o Arrow exige um tipo por coluna."""
+    colunas_texto = df.select_dtypes(include='object').columns
+    return df.astype({col: 'string' for col in colunas_texto})
+
+def _alinhar_tipos_ao_historico(df_historico: pd.DataFrame, df_novos: pd.DataFrame) -> pd.DataFrame:
+    """Converte as colunas dos dados novos para o tipo do histórico; o histórico nunca é alterado."""
+    df_novos = df_novos.copy()
+    for col in df_historico.columns.intersection(df_novos.columns):
+        tipo_hist, serie = df_historico[col].dtype, df_novos[col]
+        if tipo_hist == serie.dtype:
+            continue
+        if pd.api.types.is_numeric_dtype(tipo_hist) and not pd.api.types.is_numeric_dtype(serie):
+            convertida = pd.to_numeric(serie, errors='coerce')
+        elif pd.api.types.is_datetime64_any_dtype(tipo_hist) and not pd.api.types.is_datetime64_any_dtype(serie):
+            convertida = pd.to_datetime(serie, errors='coerce')
+        else:
+            continue
+        # Só é texto de fato quando nenhum valor preenchido converte; nesse caso a coluna fica como string
+        if serie.notna().any() and convertida.isna().all():
+            df_novos[col] = serie.astype('string')
+        else:
+            df_novos[col] = convertida
+    return df_novos
+
+def concatenar_historico(df_historico: pd.DataFrame, df_novos: pd.DataFrame) -> pd.DataFrame:
+    """Anexa os dados novos ao histórico via tabelas Arrow (concat_tables com promoção de esquema)."""
+    df_novos = _colunas_object_como_string(_alinhar_tipos_ao_historico(df_historico, df_novos))
+    try:
+        tabelas = [pa.Table.from_pandas(df, preserve_index=False) for df in (df_historico, df_novos)]
+        # 'permissive' alinha colunas ausentes (nulas) e promove tipos numéricos divergentes
+        tabela = pa.concat_tables(tabelas, promote_options='permissive')
+        return tabela.to_pandas(split_blocks=True, self_destruct=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        logging.warning(f"⚠️ Esquemas incompatíveis entre histórico e dados novos ({e}). Concatenando via pandas.")
+        return pd.concat([df_historico, df_novos], ignore_index=True)
+
 def coletar_dados_do_datalake(source_config: Dict[str, Any], general_config: Config) -> pd.DataFrame:
     logging.info(f"--- Iniciando coleta da fonte: {source_config['name']} ---")
     sp_client = SharePointClient(source_config, general_config)
@@ -244,7 +404,9 @@ def coletar_dados_do_datalake(source_config: Dict[str, Any], general_config: Con
         return pd.DataFrame()
         
     list_of_dataframes = []
-    files_to_process = [item for item in all_items if "file" in item and not any(k in item['name'].lower() for k in general_config.KEYWORDS_TO_EXCLUDE)]
+    files_to_process = [item for item in all_items if "file" in item and not general_config.KEYWORDS_TO_EXCLUDE_RE.search(item['name'])]
+
+    filename_map_lower = [(k.lower(), v) for k, v in general_config.FILENAME_MAP.items()]
 
     for item in files_to_process:
         df = sp_client.read_excel_sheet(item['id'], item['name'])
@@ -259,7 +421,8 @@ def coletar_dados_do_datalake(source_config: Dict[str, Any], general_config: Con
                 logging.warning(f"⚠️ Colunas duplicadas detectadas no arquivo {item['name']}. Limpando...")
                 df = df.loc[:, ~df.columns.duplicated()]
             
-            mapped_name = next((v for k, v in general_config.FILENAME_MAP.items() if k.lower() in item['name'].lower()), item['name'])
+            name_lower = item['name'].lower()
+            mapped_name = next((v for k, v in filename_map_lower if k in name_lower), item['name'])
             df['Origem'] = mapped_name
             list_of_dataframes.append(df)
             
@@ -276,9 +439,9 @@ def aplicar_de_para_empresa(df: pd.DataFrame) -> pd.DataFrame:
         caminho_de_para = os.path.join(home_dir, 'Documentos', 'De Para', 'Empresa.csv')
         df_de_para = pd.read_csv(caminho_de_para, sep=';', encoding='latin-1')
         df_de_para.columns = df_de_para.columns.str.strip()
-        df_merged = pd.merge(df, df_de_para[['De', '2_EMPRESA']], left_on='EMPRESA', right_on='De', how='left')
-        df_merged['EMPRESA'] = df_merged['2_EMPRESA'].fillna(df_merged['EMPRESA'])
-        return df_merged.drop(columns=['De', '2_EMPRESA'])
+        # Tabela pequena: lookup por dicionário em vez de merge (sem colunas auxiliares nem cópia do frame)
+        mapa_empresa = dict(zip(df_de_para['De'], df_de_para['2_EMPRESA']))
+        return df.assign(EMPRESA=df['EMPRESA'].map(mapa_empresa).fillna(df['EMPRESA']))
     except:
         return df
 
@@ -304,11 +467,14 @@ def main():
         cols_to_fill = ['TANQUE', 'PRODUTO']
         for col in cols_to_fill:
             if col in df_novos.columns:
-                df_novos[col] = df_novos[col].replace(r'^\s*(-)?\s*$', np.nan, regex=True).ffill()
+                # Células vazias ou só com '-' herdam o valor de cima (máscara + ffill, sem regex por célula)
+                vazio = df_novos[col].astype(str).str.strip().isin(['', '-'])
+                df_novos[col] = df_novos[col].mask(vazio).ffill()
         
         if 'EMPRESA' in df_novos.columns:
-            df_novos['EMPRESA'] = df_novos['EMPRESA'].astype(str)
-            df_novos = df_novos[~df_novos['EMPRESA'].str.strip().isin(['-', '', 'nan'])]
+            empresa = df_novos['EMPRESA'].astype(str)
+            df_novos['EMPRESA'] = empresa
+            df_novos = df_novos[~empresa.str.strip().isin(Config.EMPRESAS_INVALIDAS)]
         
         df_novos.drop(columns=['TANQUE'], inplace=True, errors='ignore')
 
@@ -318,7 +484,11 @@ def main():
 
         # 3. Gestão de Histórico no SharePoint
         sp_writer = SharePointClient(Config.DESTINATION_CONFIG, Config)
-        df_historico_antigo = sp_writer.read_sharepoint_history(Config.SHAREPOINT_DEST_FILE, Config.SHAREPOINT_DEST_SHEET)
+        df_historico_antigo = sp_writer.read_parquet_history(Config.SHAREPOINT_HIST_FILE)
+        migrando_do_xlsx = df_historico_antigo is None
+        if migrando_do_xlsx:
+            # Primeira execução com Parquet (arquivo inexistente): migra o histórico que estava na aba consolidada do XLSX
+            df_historico_antigo = sp_writer.read_sharepoint_history(Config.SHAREPOINT_DEST_FILE, Config.SHAREPOINT_DEST_SHEET)
 
         if not df_historico_antigo.empty:
             # Limpeza de duplicatas: Remove do histórico o que já existe com a data de hoje
@@ -327,8 +497,12 @@ def main():
                 df_historico_preservado = df_historico_antigo[df_historico_antigo['DATA_ATUALIZACAO'] != today_str]
             else:
                 df_historico_preservado = df_historico_antigo
+            # Mesmo formato texto dos dados novos (o XLSX devolve datetime)
+            if 'DATA_HORA_EXECUCAO' in df_historico_preservado.columns:
+                df_historico_preservado = df_historico_preservado.assign(DATA_HORA_EXECUCAO=pd.to_datetime(
+                    df_historico_preservado['DATA_HORA_EXECUCAO'], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S'))
             
-            df_final = pd.concat([df_historico_preservado, df_novos], ignore_index=True)
+            df_final = concatenar_historico(df_historico_preservado, df_novos)
             logging.info(f"📊 Histórico preservado: {len(df_historico_preservado)} linhas.")
         else:
             df_final = df_novos
@@ -336,16 +510,24 @@ def main():
         # 4. Filtros Finais e DE-PARA
         df_final = df_final.loc[:, ~df_final.columns.str.contains('^UNNAMED', case=False, na=False)]
         if 'PRODUTO' in df_final.columns:
-            df_final = df_final[~df_final['PRODUTO'].astype(str).str.strip().str.upper().isin(Config.PRODUTOS_EXCLUIDOS)]
+            # strip/upper só nos produtos distintos; a máscara volta para as linhas pelos códigos
+            codigos, produtos = pd.factorize(df_final['PRODUTO'].astype(str))
+            excluido = pd.Index(produtos).str.strip().str.upper().isin(Config.PRODUTOS_EXCLUIDOS)
+            df_final = df_final[~excluido[codigos]]
         
         df_final = aplicar_de_para_empresa(df_final)
 
-        # 5. Salva Consolidado e Atual
-        sp_writer.overwrite_sheet_with_dataframe(Config.SHAREPOINT_DEST_FILE, Config.SHAREPOINT_DEST_SHEET, df_final)
+        # 5. Salva Consolidado (Parquet) e Atual (XLSX)
+        sp_writer.upload_dataframe_as_parquet(Config.SHAREPOINT_HIST_FILE, df_final)
         
         df_atual = df_final[df_final['DATA_ATUALIZACAO'] == today_str].copy()
         sp_writer.overwrite_sheet_with_dataframe(Config.SHAREPOINT_DEST_FILE, "Atual", df_atual)
 
+        if migrando_do_xlsx and not df_historico_antigo.empty:
+            # Histórico já está no Parquet: a aba consolidada deixaria de ser atualizada (dado congelado), então é removida.
+            # Depois da aba "Atual", para o workbook nunca ficar sem abas
+            sp_writer.delete_worksheet(Config.SHAREPOINT_DEST_FILE, Config.SHAREPOINT_DEST_SHEET)
+
         logging.info("✅ Sucesso total! Processo finalizado apenas no SharePoint.")
 
     except Exception as e: